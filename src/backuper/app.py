@@ -1,12 +1,46 @@
+import os
+import json
 import logging
 import utilities
 
-from flask import Flask, request, jsonify
-from pprint import pprint
-from backuper import Backuper
+from flask import Flask, Response, request, jsonify, stream_with_context
+from jobs import JobManager, ACTIVE
+from backuper import ENGINES
 
 app = Flask(__name__)
-service = Backuper()
+jobs = JobManager(workers = int(os.environ.get('BACKUPER_WORKERS', 2)))
+
+def parse_bool(value):
+    ''' JSON booleans or "true"/"false", anything else is refused '''
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ValueError(f"expected true or false, got {value!r}")
+
+def parse_int(value, minimum):
+    ''' Integers or their digits as text, at least minimum '''
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"expected an integer, got {value!r}")
+    if value < minimum:
+        raise ValueError(f"expected at least {minimum}, got {value}")
+    return value
+
+def parse_engine(value):
+    if value not in ENGINES:
+        raise ValueError(f"expected one of {', '.join(ENGINES)}, got {value!r}")
+    return value
+
+def option(data, name, parse, default = None):
+    ''' Parsed request field, errors name the field '''
+    if data.get(name) is None:
+        return default
+    try:
+        return parse(data[name])
+    except ValueError as inst:
+        raise ValueError(f"Invalid {name}: {inst}")
 
 @app.route('/stream_monitor/backuper', methods=['POST'])
 def stream_monitor_backuper():
@@ -14,13 +48,70 @@ def stream_monitor_backuper():
     data = request.get_json()
     if "dest" in data and "source" in data:
         
-        service.move_files(data["source"], 
-                           data["dest"], 
-                           dry_run = data['dry_run'] if 'dry_run' in data else None)
-        return jsonify({'message': 'ok'})
+        # bad options are refused here, not in a worker
+        try:
+            # source is only removed when asked for explicitly
+            options = {'dry_run':  option(data, 'dry_run', parse_bool, True),
+                       'engine':   option(data, 'engine', parse_engine),
+                       'shards':   option(data, 'shards', lambda value: parse_int(value, 0), 0),
+                       'parallel': option(data, 'parallel', lambda value: parse_int(value, 1))}
+        except ValueError as inst:
+            return jsonify({'error': str(inst)}), 400
+        
+        job, created = jobs.submit(data["source"], 
+                                   data["dest"], 
+                                   **options)
+        return jsonify({'job': job.id, 
+                        'state': job.state, 
+                        'duplicate': not created}), 202
     else:
         return jsonify({'error': 'Message missing source or dest'}), 404
 
+@app.route('/stream_monitor/backuper/jobs', methods=['GET'])
+def stream_monitor_backuper_jobs():
+    return jsonify({'jobs': jobs.list()})
+
+@app.route('/stream_monitor/backuper/<job_id>', methods=['GET'])
+def stream_monitor_backuper_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    return jsonify(job.status())
+
+@app.route('/stream_monitor/backuper/<job_id>/progress', methods=['GET'])
+def stream_monitor_backuper_progress(job_id):
+    '''
+    Streams progress of a job until it ends, as Server-Sent Events or
+    as JSON lines with ?format=jsonl. Updates are sent at most once
+    per ?interval seconds, one by default.
+    '''
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    interval = max(request.args.get('interval', 1.0, type=float), 0.1)
+    lines = request.args.get('format') == 'jsonl' or \
+            request.accept_mimetypes.best == 'application/x-ndjson'
+    
+    def generate():
+        for snapshot in job.stream(interval):
+            if lines:
+                yield json.dumps(snapshot) + '\n'
+            else:
+                event = 'progress' if snapshot['state'] in ACTIVE else 'end'
+                yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+    
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson' if lines else 'text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/stream_monitor/backuper/<job_id>', methods=['DELETE'])
+@app.route('/stream_monitor/backuper/<job_id>/cancel', methods=['POST'])
+def stream_monitor_backuper_cancel(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    return jsonify(job.status())
+
 if __name__ == '__main__':
     logFormatter="'%(asctime)s|%(levelname)7s|%(name)25s|%(message)s'"
     logging.basicConfig(format=logFormatter, level=logging.DEBUG)
@@ -1,17 +1,31 @@
+import os
+import time
+import shards
+import copier
+import signal
 import subprocess
 import utilities
 import logging
-import pathlib
-import shutil
-from optparse import OptionParser, OptionGroup
-from pprint import pprint
+
+from datetime import timedelta
+from progress import ProgressParser, OUT_FORMAT
 
 LOG_NAME = "Backup"
+ENGINES  = ("rsync", "native")
 
 class Backuper:
-    def __init__(self) -> None:
+    def __init__(self, structured = False, shards = 0, parallel = None, 
+                 engine = 'rsync') -> None:
         class_name  = self.__class__.__name__
         self.logger = utilities.GetLogger(class_name)
+        self.engine     = engine or 'rsync'
+        self.structured = structured
+        self.shards     = shards or 0
+        self.parallel   = parallel or self.shards
+        self.listeners  = []
+        self.processes  = []
+        self.copier     = None
+        self.cancelled  = False
         self.patterns = {
             'size': 'files to consider',
             'copying': [
@@ -96,14 +110,39 @@ class Backuper:
         except Exception as inst:
             utilities.ParseException(inst)
             
+    def spawn(self, cmd, **kwargs):
+        ''' Starts a process that cancel() can stop '''
+        if self.cancelled:
+            raise InterruptedError("backup was cancelled")
+        # own process group, so rsync helpers are stopped with it
+        popen = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+        self.processes.append(popen)
+        return popen
+        
+    def wait(self, popen):
+        return_code = popen.wait()
+        self.processes.remove(popen)
+        return return_code
+        
+    def cancel(self):
+        ''' Stops running copies, files already moved stay moved '''
+        self.cancelled = True
+        if self.copier is not None:
+            self.copier.stopped = True
+        for popen in list(self.processes):
+            try:
+                os.killpg(popen.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            
     def execute(self, cmd):
         stdout_line = None
         try:
-            popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+            popen = self.spawn(cmd, stdout=subprocess.PIPE, universal_newlines=True)
             for stdout_line in iter(popen.stdout.readline, ""):
                 self.parse_outout(stdout_line.strip())
             popen.stdout.close()
-            return_code = popen.wait()
+            return_code = self.wait(popen)
             if return_code:
                 raise subprocess.CalledProcessError(return_code, cmd)
         except Exception as inst:
@@ -111,9 +150,151 @@ class Backuper:
         finally:
             return stdout_line
 
-    def copy_files(self, source, destination):
-        command = ["rsync", "-rP", "--remove-source-files", source, destination]
+    def on_event(self, event):
+        ''' Keeps track of copied files and hands events to listeners '''
+        if event['type'] == 'file':
+            self.backup.append(event['name'])
+            self.logger.info('[%d] %s: %s'%(len(self.backup), 
+                                            event['name'], 
+                                            utilities.human_readable_data(event['size'])))
+        elif event['type'] == 'progress':
+            self.logger.debug('%d%% %s at %s, %s left'%(event['percent'], 
+                                                       utilities.human_readable_data(event['bytes']), 
+                                                       event['rate'], 
+                                                       event['eta']))
+        elif event['line']:
+            self.logger.debug(f"=> {event['line']}")
+        
+        for listener in self.listeners:
+            listener(event)
+            
+    def execute_structured(self, cmd, callback = None):
+        ''' Runs rsync reading its output in binary chunks '''
+        return_code = None
+        try:
+            parser = ProgressParser(callback or self.on_event)
+            popen = self.spawn(cmd, stdout=subprocess.PIPE, bufsize=0)
+            fd = popen.stdout.fileno()
+            for chunk in iter(lambda: os.read(fd, 65536), b""):
+                parser.feed(chunk)
+            parser.close()
+            popen.stdout.close()
+            return_code = self.wait(popen)
+            if return_code:
+                raise subprocess.CalledProcessError(return_code, cmd)
+        except Exception as inst:
+            utilities.ParseException(inst)
+        finally:
+            return return_code
+
+    def copy_sharded(self, source, destination, dry_run = False):
+        '''
+        Copies source in size balanced shards with concurrent rsync 
+        workers, returns True only if every shard finished
+        '''
+        import tempfile
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        
+        # files-from lists only carry files, the directory tree goes
+        # first so empty directories are not lost with the source
+        if os.path.isdir(source):
+            command = ["rsync", "-r", "--include=*/", "--exclude=*", source, destination]
+            if dry_run:
+                command.insert(1, "--dry-run")
+            if self.execute_structured(command) != 0:
+                self.logger.warning(f"Failed to copy directories of {source}")
+                return False
+        
+        root, files = shards.source_files(source)
+        if len(files) < 1:
+            self.logger.info(f"No files to copy in {source}")
+            return True
+        
+        parts = shards.pack(files, self.shards)
+        total = sum([size for name, size in files])
+        self.logger.info(f"Copying {len(files)} files of {utilities.human_readable_data(total)} "
+                         f"in {len(parts)} shards, {self.parallel} at a time")
+        
+        lock  = threading.Lock()
+        start = time.time()
+        state = {'bytes': [0] * len(parts), 'files': 0}
+        
+        def merged(shard):
+            # shards report their own progress, it is summed up
+            def callback(event):
+                with lock:
+                    if event['type'] == 'file':
+                        state['files'] += 1
+                        event['shard'] = shard
+                    elif event['type'] == 'progress':
+                        state['bytes'][shard] = event['bytes']
+                        done = sum(state['bytes'])
+                        rate = done / max(time.time() - start, 0.001)
+                        left = (total - done) / rate if rate > 0 else 0
+                        event = {'type':    'progress',
+                                 'bytes':   done,
+                                 'percent': int(100 * done / total) if total else 100,
+                                 'rate':    utilities.human_readable_data(rate) + '/s',
+                                 'eta':     str(timedelta(seconds=int(left))),
+                                 'files':   state['files'],
+                                 'left':    len(files) - state['files'],
+                                 'total':   len(files)}
+                    self.on_event(event)
+            return callback
+        
+        def run(shard, names):
+            with tempfile.NamedTemporaryFile(prefix='backuper-', suffix='.files') as listing:
+                listing.write(b'\0'.join([os.fsencode(name) for name in names]))
+                listing.flush()
+                command = ["rsync", "--from0", f"--files-from={listing.name}", 
+                           "--remove-source-files", "--no-inc-recursive", 
+                           "--info=progress2", f"--out-format={OUT_FORMAT}", 
+                           root, destination]
+                if dry_run:
+                    command.insert(1, "--dry-run")
+                return self.execute_structured(command, merged(shard))
+        
+        with ThreadPoolExecutor(max_workers=max(1, self.parallel)) as pool:
+            codes = list(pool.map(run, range(len(parts)), [names for size, names in parts]))
+        
+        failed = [shard for shard, code in enumerate(codes) if code != 0]
+        if len(failed) > 0:
+            self.logger.warning(f"{len(failed)} of {len(parts)} shards failed: {failed}")
+            return False
+        self.logger.info(f"Copied {len(parts)} shards in {timedelta(seconds=int(time.time() - start))}")
+        return True
+
+    def copy_native(self, source, destination, dry_run = False):
+        ''' Moves local files in process, None for remote destinations '''
+        if copier.is_remote(destination):
+            self.logger.info(f"{destination} is not local, copying with rsync")
+            return None
+        self.copier = copier.LocalCopier(self.on_event)
+        if self.cancelled:
+            self.copier.stopped = True
+        return self.copier.copy(source, destination, dry_run)
+
+    def copy_files(self, source, destination, dry_run = False, engine = None):
+        if (engine or self.engine) == 'native':
+            copied = self.copy_native(source, destination, dry_run)
+            if copied is not None:
+                return copied
+        if self.shards > 1:
+            return self.copy_sharded(source, destination, dry_run)
+        if self.structured:
+            # whole file list is built first so totals are known
+            command = ["rsync", "-r", "--remove-source-files", "--no-inc-recursive",
+                       "--info=progress2", f"--out-format={OUT_FORMAT}", 
+                       source, destination]
+        else:
+            command = ["rsync", "-rP", "--remove-source-files", source, destination]
+        if dry_run:
+            # only lists what would be copied
+            command.insert(1, "--dry-run")
         try:
+            if self.structured:
+                return self.execute_structured(command) == 0
             for path in self.execute(command):
                 # print(path, end="")
                 pass
@@ -121,6 +302,13 @@ class Backuper:
             utilities.ParseException(inst)
    
     def remove_source(self, source, dry_run = True):
+        import pathlib
+        import shutil
+        
+        # moved away as a whole
+        if not os.path.lexists(source):
+            self.logger.info(f"Nothing left in {source}")
+            return True
         
         # check of files are still in source path
         source_path = pathlib.Path(source)
@@ -132,17 +320,31 @@ class Backuper:
             return False
         
         # remove directory
+        if dry_run:
+            self.logger.info(f"Would remove path and contents of {source}")
+            return True
         self.logger.info(f"Removing path and contents of {source}")
-        if dry_run: shutil.rmtree(source)
+        shutil.rmtree(source)
+        return True
         
-    def move_files(self, source, destination, dry_run = True):
+    def move_files(self, source, destination, dry_run = True, engine = None):
         # start by copying files to destination
-        self.copy_files(source, destination)
+        copied = self.copy_files(source, destination, dry_run, engine)
+        if copied is False or self.cancelled:
+            self.logger.warning(f"Copy of {source} did not finish, source is kept")
+            return False
+        
+        # source files are all still there in a dry run
+        if dry_run:
+            self.logger.info(f"Dry run, {source} is left as it is")
+            return True
         
         # confirm files are copied
-        self.remove_source(source, dry_run)
+        return self.remove_source(source, dry_run)
         
 if __name__ == '__main__':
+    from optparse import OptionParser, OptionGroup
+    
     # create logger
     logFormatter="'%(asctime)s|%(levelname)7s|%(name)25s|%(message)s'"
     logging.basicConfig(format=logFormatter, level=logging.DEBUG)
@@ -162,6 +364,26 @@ if __name__ == '__main__':
                         action="store_true", 
                         default=False,
                         help="Dry run option")
+    app_opts.add_option("--structured", 
+                        action="store_true", 
+                        default=False,
+                        help="Parse rsync machine readable progress")
+    app_opts.add_option("--shards", 
+                        type="int",
+                        action="store",
+                        default=0,
+                        help="Split source in size balanced shards copied by parallel rsync workers")
+    app_opts.add_option("--parallel", 
+                        type="int",
+                        action="store",
+                        default=None,
+                        help="Maximum rsync workers at once, one per shard by default")
+    app_opts.add_option("--engine", 
+                        type="choice",
+                        choices=list(ENGINES),
+                        action="store",
+                        default="rsync",
+                        help="Copy with rsync or natively for local destinations")
     
     parser.add_option_group(app_opts)
     (options, args) = parser.parse_args()
@@ -173,7 +395,10 @@ if __name__ == '__main__':
     if not options.dest:
         parser.error("dest path is required")
     
-    backuper = Backuper()
+    backuper = Backuper(structured = options.structured,
+                        shards = options.shards,
+                        parallel = options.parallel,
+                        engine = options.engine)
     backuper.move_files(options.source, 
                         options.dest, 
                         dry_run = options.dry_run)
@@ -183,7 +408,7 @@ if __name__ == '__main__':
 
 # curl -X POST \
 #      -H "Content-Type: application/json" \
-#      -d '{"source": "/series/cartoons/drive3/original_files", "dest": "/series/cartoons/drive2", "dry_run": "Fale"}' \
+#      -d '{"source": "/series/cartoons/drive3/original_files", "dest": "/series/cartoons/drive2", "dry_run": false}' \
 #          http://127.0.0.1:5001/stream_monitor/backuper
 
 # rm -rf /series/cartoons/drive3/original_files; python backuper.py --source /series/cartoons/drive2/original_files --dest /series/cartoons/drive3
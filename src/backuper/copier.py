@@ -0,0 +1,180 @@
+import os
+import time
+import shards
+import threading
+import utilities
+
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# bytes asked to the kernel per call, progress is reported as often
+CHUNK = 64 * 1024 * 1024
+
+def is_remote(path):
+    ''' rsync style host:path, host::module and rsync:// destinations '''
+    if path.startswith('rsync://') or '::' in path:
+        return True
+    head = path.split('/')[0]
+    return ':' in head
+
+def kernel_copy(source_fd, destination_fd, size, progress):
+    '''
+    Copies with copy_file_range, or sendfile where it is not
+    supported, both stay in the kernel
+    '''
+    copied = 0
+    use_range = hasattr(os, 'copy_file_range')
+    while copied < size:
+        count = min(CHUNK, size - copied)
+        sent = 0
+        if use_range:
+            try:
+                sent = os.copy_file_range(source_fd, destination_fd, count)
+            except OSError:
+                # e.g. older kernels across file systems
+                use_range = False
+        if not use_range:
+            sent = os.sendfile(destination_fd, source_fd, None, count)
+        if sent == 0:
+            break
+        copied += sent
+        progress(sent)
+    return copied
+
+class LocalCopier:
+    '''
+    Moves files between local paths without rsync. Within one file
+    system files are renamed, otherwise copied by the kernel with
+    mtimes and permissions kept, small files in a thread pool.
+    Copied files are removed from source as with rsync
+    --remove-source-files. Events are the ones of ProgressParser.
+    '''
+    def __init__(self, callback, workers = 8, small = 8 * 1024 * 1024):
+        class_name  = self.__class__.__name__
+        self.logger = utilities.GetLogger(class_name)
+        self.callback = callback
+        self.workers  = workers
+        self.small    = small
+        self.lock     = threading.Lock()
+        self.total    = 0
+        self.count    = 0
+        self.done     = 0
+        self.files    = 0
+        self.start    = None
+        self.stopped  = False
+
+    def emit(self, event):
+        with self.lock:
+            self.callback(event)
+
+    def status(self):
+        rate = self.done / max(time.time() - self.start, 0.001)
+        left = (self.total - self.done) / rate if rate > 0 else 0
+        return {'type':    'progress',
+                'bytes':   self.done,
+                'percent': int(100 * self.done / self.total) if self.total else 100,
+                'rate':    utilities.human_readable_data(rate) + '/s',
+                'eta':     str(timedelta(seconds=int(left))),
+                'files':   self.files,
+                'left':    self.count - self.files,
+                'total':   self.count}
+
+    def progress(self, sent):
+        if self.stopped:
+            raise InterruptedError("copy was cancelled")
+        with self.lock:
+            self.done += sent
+            self.callback(self.status())
+
+    def finished(self, name, size):
+        with self.lock:
+            self.files += 1
+            self.callback({'type': 'file', 'name': name, 'size': size, 'sent': size})
+
+    def copy_file(self, source, destination):
+        stat = os.stat(source)
+        folder, name = os.path.split(destination)
+        os.makedirs(folder, exist_ok=True)
+
+        # written aside and renamed, a broken copy is never taken for a good one
+        partial = os.path.join(folder, f".{name}.partial")
+        try:
+            with open(source, 'rb') as reader, open(partial, 'wb') as writer:
+                copied = kernel_copy(reader.fileno(), writer.fileno(), stat.st_size, self.progress)
+            if copied != stat.st_size:
+                raise IOError(f"{source} copied {copied} of {stat.st_size} bytes")
+            os.chmod(partial, stat.st_mode & 0o7777)
+            os.utime(partial, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(partial, destination)
+        except BaseException:
+            if os.path.lexists(partial):
+                os.unlink(partial)
+            raise
+        os.unlink(source)
+
+    def move_file(self, root, destination, name, size, rename):
+        if self.stopped:
+            return False
+        try:
+            source = os.path.join(root, name)
+            target = os.path.join(destination, name)
+            if rename:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(source, target)
+                self.progress(size)
+            else:
+                self.copy_file(source, target)
+            self.finished(name, size)
+            return True
+        except Exception as inst:
+            self.emit({'type': 'line', 'line': f"Failed to move {name}: {inst}"})
+            utilities.ParseException(inst, logger=self.logger)
+            return False
+
+    def copy(self, source, destination, dry_run = False):
+        ''' Returns True if every file got to destination '''
+        root, files = shards.source_files(source)
+        self.total = sum([size for name, size in files])
+        self.count = len(files)
+        self.start = time.time()
+        if dry_run:
+            for name, size in files:
+                self.finished(name, size)
+            return True
+
+        os.makedirs(destination, exist_ok=True)
+        rename = os.stat(root).st_dev == os.stat(destination).st_dev
+        self.logger.info(f"{'Renaming' if rename else 'Copying'} {len(files)} files of "
+                         f"{utilities.human_readable_data(self.total)} into {destination}")
+
+        # whole directory goes at once when nothing is in the way
+        top = os.path.join(destination, os.path.basename(source.rstrip('/')))
+        if rename and not source.endswith('/') and not os.path.lexists(top):
+            try:
+                os.rename(source, top)
+            except OSError as inst:
+                # e.g. a mount point or a busy directory, files go one by one
+                self.logger.info(f"Could not rename {source}, moving its files: {inst}")
+            else:
+                for name, size in files:
+                    self.finished(name, size)
+                with self.lock:
+                    self.done = self.total
+                    self.callback(self.status())
+                return True
+
+        # tree is mirrored first, empty directories would be lost
+        # when source is removed
+        for name in shards.directories(source):
+            os.makedirs(os.path.join(destination, name), exist_ok=True)
+
+        small = [(name, size) for name, size in files if size <= self.small]
+        large = [(name, size) for name, size in files if size > self.small]
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            pending = [pool.submit(self.move_file, root, destination, name, size, rename)
+                       for name, size in small]
+            # large files stream one after another next to the pool
+            results = [self.move_file(root, destination, name, size, rename)
+                       for name, size in large]
+            results += [future.result() for future in pending]
+        return all(results)
@@ -0,0 +1,246 @@
+import os
+import time
+import uuid
+import threading
+import utilities
+
+from collections import deque
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from backuper import Backuper
+
+QUEUED    = 'queued'
+RUNNING   = 'running'
+DONE      = 'done'
+FAILED    = 'failed'
+CANCELLED = 'cancelled'
+
+ACTIVE = (QUEUED, RUNNING)
+
+# seconds of samples behind the current throughput
+RATE_WINDOW = 5
+# names of completed files kept for streams behind
+RECENT_FILES = 1000
+# unchanged snapshots are still sent this often
+KEEPALIVE = 15
+
+def job_key(source, dest):
+    # a trailing slash on source copies its contents, not itself
+    return (os.path.normpath(source) + ('/' if source.endswith('/') else ''),
+            os.path.normpath(dest))
+
+class Job:
+    '''
+    One move request with its own Backuper, so parser state is
+    never shared with other jobs
+    '''
+    def __init__(self, source, dest, dry_run = None, engine = None,
+                 shards = 0, parallel = None):
+        self.id       = uuid.uuid4().hex
+        self.source   = source
+        self.dest     = dest
+        self.dry_run  = dry_run
+        self.engine   = engine
+        self.state    = QUEUED
+        self.created  = time.time()
+        self.started  = None
+        self.finished = None
+        self.error    = None
+        self.files    = 0
+        self.bytes    = 0
+        self.sent     = 0
+        self.total    = None
+        self.progress = None
+        self.recent   = deque(maxlen=RECENT_FILES)
+        self.samples  = deque()
+        self.version  = 0
+        self.changed  = threading.Condition()
+        self.backuper = Backuper(structured = True,
+                                 shards = shards,
+                                 parallel = parallel,
+                                 engine = engine)
+        self.backuper.listeners.append(self.on_event)
+
+    def key(self):
+        return job_key(self.source, self.dest)
+
+    def on_event(self, event):
+        ''' Called from copy threads, shards report at the same time '''
+        with self.changed:
+            if event['type'] == 'file':
+                self.files += 1
+                self.sent  += event['sent']
+                self.recent.append({'name': event['name'], 'size': event['size']})
+            elif event['type'] == 'progress':
+                self.progress = event
+                # rsync only tells how far it is
+                if event['percent'] > 0:
+                    self.total = max(event['bytes'], event['bytes'] * 100 // event['percent'])
+            else:
+                return
+            self.bytes = max(self.bytes, self.sent, self.progress['bytes'] if self.progress else 0)
+            now = time.time()
+            if not self.samples or now - self.samples[-1][0] >= 0.5:
+                self.samples.append((now, self.bytes))
+            while now - self.samples[0][0] > RATE_WINDOW:
+                self.samples.popleft()
+            self.version += 1
+            self.changed.notify_all()
+
+    def set_state(self, state):
+        with self.changed:
+            self.state = state
+            if state == RUNNING:
+                self.started = time.time()
+            elif state not in ACTIVE:
+                self.finished = time.time()
+            self.version += 1
+            self.changed.notify_all()
+
+    def snapshot(self, seen = 0):
+        '''
+        Transfer so far with files completed after the first seen
+        ones, as many as are still kept
+        '''
+        now = time.time()
+        with self.changed:
+            elapsed = (self.finished or now) - (self.started or now)
+            average = self.bytes / elapsed if elapsed > 0 else 0
+            current = 0
+            if self.state == RUNNING and self.samples:
+                since, done = self.samples[0]
+                current = (self.bytes - done) / (now - since) if now > since else average
+            rate = current or average
+            eta  = None
+            if self.total is not None and rate > 0:
+                eta = (self.total - self.bytes) / rate
+            new = min(self.files - seen, len(self.recent))
+            return {'id':        self.id,
+                    'state':     self.state,
+                    'files':     self.files,
+                    'completed': list(self.recent)[len(self.recent) - new:],
+                    'bytes':     self.bytes,
+                    'total':     self.total,
+                    'percent':   self.progress['percent'] if self.progress else None,
+                    'rate':      current,
+                    'average':   average,
+                    'human':     {'bytes':   utilities.human_readable_data(self.bytes),
+                                  'rate':    utilities.human_readable_data(current) + '/s',
+                                  'average': utilities.human_readable_data(average) + '/s'},
+                    'eta':       str(timedelta(seconds=int(eta))) if eta is not None else None,
+                    'elapsed':   elapsed}
+
+    def stream(self, interval = 1.0):
+        '''
+        Snapshots until the job ends, at most one every interval
+        seconds however fast files complete
+        '''
+        seen    = 0
+        version = -1
+        ticked  = 0
+        while True:
+            delay = ticked + interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            with self.changed:
+                self.changed.wait_for(lambda: self.version != version or self.state not in ACTIVE,
+                                      timeout=KEEPALIVE)
+                version = self.version
+            ticked   = time.time()
+            snapshot = self.snapshot(seen)
+            seen     = snapshot['files']
+            yield snapshot
+            if snapshot['state'] not in ACTIVE:
+                return
+
+    def status(self):
+        return {'id':       self.id,
+                'source':   self.source,
+                'dest':     self.dest,
+                'dry_run':  self.dry_run,
+                'engine':   self.engine or self.backuper.engine,
+                'state':    self.state,
+                'created':  self.created,
+                'started':  self.started,
+                'finished': self.finished,
+                'error':    self.error,
+                'files':    self.files,
+                'bytes':    self.bytes,
+                'progress': self.progress}
+
+class JobManager:
+    '''
+    Runs move jobs in a bounded pool of workers. A job for a source
+    and destination already queued or running is not submitted
+    again, the running one is returned instead.
+    '''
+    def __init__(self, workers = 2, keep = 100):
+        class_name  = self.__class__.__name__
+        self.logger = utilities.GetLogger(class_name)
+        self.lock   = threading.Lock()
+        self.jobs   = {}
+        self.keep   = keep
+        self.pool   = ThreadPoolExecutor(max_workers=max(1, workers),
+                                         thread_name_prefix='backup')
+
+    def submit(self, source, dest, **options):
+        ''' Returns the job and whether it is a new one '''
+        key = job_key(source, dest)
+        with self.lock:
+            for current in self.jobs.values():
+                if current.state in ACTIVE and current.key() == key:
+                    self.logger.info(f"Move of {source} into {dest} is already {current.state}")
+                    return current, False
+            # only built once it is known to be a new one
+            job = Job(source, dest, **options)
+            self.jobs[job.id] = job
+            self.prune()
+        self.logger.info(f"Queued job {job.id}: {source} -> {dest}")
+        self.pool.submit(self.run, job)
+        return job, True
+
+    def prune(self):
+        # only the latest finished jobs are kept
+        finished = [job for job in self.jobs.values() if job.state not in ACTIVE]
+        finished.sort(key=lambda job: job.created)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job.id]
+
+    def run(self, job):
+        with self.lock:
+            if job.state != QUEUED:
+                return
+            job.set_state(RUNNING)
+        try:
+            moved = job.backuper.move_files(job.source, job.dest,
+                                            dry_run = job.dry_run,
+                                            engine = job.engine)
+            state = DONE if moved else FAILED
+        except Exception as inst:
+            job.error = str(inst)
+            state = FAILED
+            utilities.ParseException(inst, logger=self.logger)
+        with self.lock:
+            job.set_state(CANCELLED if job.backuper.cancelled else state)
+        self.logger.info(f"Job {job.id} {job.state}")
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.status() for job in sorted(self.jobs.values(),
+                                                   key=lambda job: job.created)]
+
+    def cancel(self, job_id):
+        ''' Returns the job, None if it is not known '''
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in ACTIVE:
+                return job
+            if job.state == QUEUED:
+                job.set_state(CANCELLED)
+        job.backuper.cancel()
+        self.logger.info(f"Cancelled job {job.id}")
+        return job
@@ -0,0 +1,79 @@
+import re
+import utilities
+
+# rsync is asked to log every transferred file with this prefix,
+# sizes go first so names can hold any character
+OUT_FORMAT = "@@file %l %b %n"
+
+# one pass over each line: a transferred file or an overall
+# progress2 update, e.g. "  1,234,567  45%  10.23MB/s  0:01:23 (xfr#12, to-chk=100/200)"
+MATCHER = re.compile(
+    rb'@@file (?P<size>\d+) (?P<sent>\d+) (?P<name>.*)'
+    rb'|\s*(?P<bytes>[\d,]+)\s+(?P<percent>\d+)%\s+(?P<rate>\S+)\s+(?P<eta>[\d:]+)'
+    rb'(?:\s+\(xfr#(?P<files>\d+), \w+-chk=(?P<left>\d+)/(?P<total>\d+)\))?')
+
+LINE_END = re.compile(rb'[\r\n]')
+
+class ProgressParser:
+    '''
+    Turns rsync --out-format and --info=progress2 output read in
+    binary chunks into events:
+      {'type': 'file', 'name', 'size', 'sent'}
+      {'type': 'progress', 'bytes', 'percent', 'rate', 'eta',
+       'files', 'left', 'total'}
+    Other lines come as {'type': 'line', 'line'}.
+    '''
+    def __init__(self, callback):
+        class_name  = self.__class__.__name__
+        self.logger = utilities.GetLogger(class_name)
+        self.callback = callback
+        self.pending  = b''
+        self.files    = 0
+        self.sent     = 0
+
+    def feed(self, chunk):
+        lines = LINE_END.split(self.pending + chunk)
+        # last piece is not complete yet
+        self.pending = lines.pop()
+        for line in lines:
+            if line:
+                self.parse(line)
+
+    def close(self):
+        if self.pending:
+            self.parse(self.pending)
+            self.pending = b''
+
+    def parse(self, line):
+        match = MATCHER.match(line)
+        if match is None:
+            self.callback({'type': 'line',
+                           'line': line.decode('utf-8', 'replace').strip()})
+            return
+
+        fields = match.groupdict()
+        if fields['name'] is not None:
+            # directories are logged as well
+            if fields['name'].endswith(b'/'):
+                return
+            self.files += 1
+            self.sent  += int(fields['sent'])
+            self.callback({'type': 'file',
+                           'name': fields['name'].decode('utf-8', 'surrogateescape'),
+                           'size': int(fields['size']),
+                           'sent': int(fields['sent'])})
+            return
+
+        event = {'type':    'progress',
+                 'bytes':   int(fields['bytes'].replace(b',', b'')),
+                 'percent': int(fields['percent']),
+                 'rate':    fields['rate'].decode('ascii', 'replace'),
+                 'eta':     fields['eta'].decode('ascii'),
+                 'files':   None,
+                 'left':    None,
+                 'total':   None}
+        if fields['files'] is not None:
+            event.update({'files': int(fields['files']),
+                          'left':  int(fields['left']),
+                          'total': int(fields['total'])})
+        self.callback(event)
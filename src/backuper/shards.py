@@ -0,0 +1,69 @@
+import os
+import heapq
+import utilities
+
+def walk(path, prefix = ''):
+    '''
+    Returns (relative path, size) of every regular file under a
+    path, links and special files are skipped as rsync -r does
+    '''
+    files = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                relative = os.path.join(prefix, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    files.extend(walk(entry.path, relative))
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((relative, entry.stat(follow_symlinks=False).st_size))
+    except Exception as inst:
+        utilities.ParseException(inst)
+    return files
+
+def source_files(source):
+    '''
+    Splits an rsync source into the directory rsync runs from and
+    files relative to it, so a trailing slash keeps its meaning
+    '''
+    if os.path.islink(source) and not source.endswith('/'):
+        return os.path.dirname(source) or '.', []
+    if os.path.isfile(source):
+        root, name = os.path.split(source)
+        return root or '.', [(name, os.path.getsize(source))]
+    if source.endswith('/'):
+        return source, walk(source)
+    root, name = os.path.split(source)
+    return root or '.', walk(source, name)
+
+def directories(source):
+    '''
+    Directories under an rsync source, relative to the directory
+    rsync runs from as in source_files(), empty ones included
+    '''
+    if not os.path.isdir(source):
+        return []
+    found = []
+    prefix = ''
+    if not source.endswith('/'):
+        prefix = os.path.basename(source)
+        found.append(prefix)
+    for path, names, files in os.walk(source):
+        relative = os.path.relpath(path, source)
+        for name in names:
+            # linked directories are copied as links
+            if not os.path.islink(os.path.join(path, name)):
+                found.append(os.path.normpath(os.path.join(prefix, relative, name)))
+    return found
+
+def pack(files, count):
+    '''
+    Largest first bin packing of files into count shards of
+    similar size, returns [(total size, [relative path])]
+    '''
+    count  = max(1, min(count, len(files)))
+    shards = [(0, index, []) for index in range(count)]
+    for name, size in sorted(files, key=lambda item: item[1], reverse=True):
+        total, index, names = heapq.heappop(shards)
+        names.append(name)
+        heapq.heappush(shards, (total + size, index, names))
+    return [(total, names) for total, index, names in sorted(shards, key=lambda shard: shard[1])]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import aiohttp
+import json
+
+from qbittorrent.client import LoginRequired
+
+class AsyncClient:
+  '''
+    Subset of qbittorrent.Client used by the monitor, on top of a
+    keep-alive aiohttp session
+  '''
+  def __init__(self, url, verify=True, timeout=None, limit=8):
+    if not url.endswith('/'):
+      url += '/'
+    self.url = url + 'api/v2/'
+    self.verify = verify
+    self._is_authenticated = False
+
+    # qBittorrent hosts are usually addressed by IP, cookies
+    # would be dropped by default jar
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     keepalive_timeout=60,
+                                     ssl=None if verify else False)
+    self.session = aiohttp.ClientSession(
+      connector=connector,
+      cookie_jar=aiohttp.CookieJar(unsafe=True),
+      timeout=aiohttp.ClientTimeout(total=timeout))
+
+  async def _request(self, endpoint, method, data=None, params=None):
+    if not self._is_authenticated:
+      raise LoginRequired
+
+    async with self.session.request(method, self.url + endpoint,
+                                    data=data, params=params) as response:
+      response.raise_for_status()
+      text = await response.text(encoding='utf_8')
+
+    if len(text) == 0:
+      return {}
+    try:
+      return json.loads(text)
+    except ValueError:
+      return text
+
+  async def _get(self, endpoint, params=None):
+    return await self._request(endpoint, 'GET', params=params)
+
+  async def _post(self, endpoint, data):
+    return await self._request(endpoint, 'POST', data=data)
+
+  @staticmethod
+  def _process_infohash_list(infohash_list):
+    if isinstance(infohash_list, list):
+      return {'hashes': '|'.join([h.lower() for h in infohash_list])}
+    return {'hashes': infohash_list.lower()}
+
+  async def login(self, username='admin', password='admin'):
+    async with self.session.post(self.url + 'auth/login',
+                                 data={'username': username,
+                                       'password': password}) as response:
+      text = await response.text()
+    if text == 'Ok.':
+      self._is_authenticated = True
+    else:
+      return text
+
+  async def close(self):
+    self._is_authenticated = False
+    await self.session.close()
+
+  async def qbittorrent_version(self):
+    return await self._get('app/version')
+
+  async def api_version(self):
+    return await self._get('app/webapiVersion')
+
+  async def torrents(self, **filters):
+    params = {}
+    for name, value in filters.items():
+      name = 'filter' if name == 'status' else name
+      params[name] = value
+    return await self._get('torrents/info', params=params)
+
+  async def sync_main_data(self, rid=0):
+    return await self._get('sync/maindata', params={'rid': rid})
+
+  async def get_torrent_trackers(self, infohash):
+    return await self._get('torrents/trackers', params={'hash': infohash.lower()})
+
+  async def add_trackers(self, infohash, trackers):
+    data = {'hash': infohash.lower(), 'urls': trackers}
+    return await self._post('torrents/addTrackers', data)
+
+  async def pause_multiple(self, infohash_list):
+    return await self._post('torrents/pause',
+                            self._process_infohash_list(infohash_list))
+
+  async def resume_multiple(self, infohash_list):
+    return await self._post('torrents/resume',
+                            self._process_infohash_list(infohash_list))
+
+  async def recheck(self, infohash_list):
+    return await self._post('torrents/recheck',
+                            self._process_infohash_list(infohash_list))
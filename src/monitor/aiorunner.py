@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+SLEEP_TIME = 5
+
+import asyncio
+import utilities
+import time
+
+from runner import Scheduler, wakeup_socket
+from signal import SIGTERM, SIGINT, SIGUSR1
+
+class AsyncRunner:
+  '''
+    Same contract as runner.Runner, app function runs in an asyncio
+    event loop within current process. A list of app functions gets
+    one independent loop per function.
+  '''
+  def __init__(self, **kwargs):
+    try:
+      self.logger.debug("Starting async runner")
+
+      # Initialising class variables
+      self.component    = self.__class__.__name__
+      self.logger       = utilities.GetLogger("AsyncRunner")
+      self.app_func     = None
+      self.time_out     = None
+      self.sleep_time   = SLEEP_TIME
+      self.stop_running = False
+      self.stop_event   = None
+      self.wake_events  = []
+      self.hint_func    = None
+      self.wakeup_path  = None
+      self.config       = kwargs
+
+      for key in kwargs.keys():
+        if key == "app_func":
+          self.app_func   = kwargs[key]
+        elif key == "time_out":
+          self.time_out = kwargs[key]
+          self.logger.debug("  Set timeout to %ds"%self.time_out)
+        elif key == "sleep_time" and kwargs[key] is not None:
+          self.sleep_time = kwargs[key]
+          self.logger.debug("  Set sleep time to %ds"%self.sleep_time)
+        elif key == "hint_func":
+          self.hint_func = kwargs[key]
+        elif key == "wakeup_socket":
+          self.wakeup_path = kwargs[key]
+
+      self.start()
+      self.logger.debug("  Ended async runner object")
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def start(self):
+    asyncio.run(self.run())
+
+  def signal_handler(self):
+    self.logger.info("  Handling runner signal")
+    self.logger.debug("  Stop running app")
+    self.stop_running = True
+    self.stop_event.set()
+
+  def wakeup_handler(self):
+    self.logger.info("  Waking up runner")
+    for wake_event in self.wake_events:
+      wake_event.set()
+
+  def wakeup_message(self, sock):
+    try:
+      sock.recv(4096)
+      self.wakeup_handler()
+    except (BlockingIOError, InterruptedError):
+      pass
+
+  async def call_app(self, app_func):
+    if asyncio.iscoroutinefunction(app_func):
+      return await app_func()
+
+    # blocking functions should not stall the loop
+    return await asyncio.to_thread(app_func)
+
+  async def timeout(self, seconds, wake_event = None):
+    '''
+      Waits given seconds unless runner is stopped or woken up
+    '''
+    waiters = [asyncio.ensure_future(self.stop_event.wait())]
+    if wake_event is not None:
+      waiters.append(asyncio.ensure_future(wake_event.wait()))
+    try:
+      await asyncio.wait(waiters, timeout=max(0, seconds),
+                         return_when=asyncio.FIRST_COMPLETED)
+    finally:
+      for waiter in waiters:
+        waiter.cancel()
+      if wake_event is not None:
+        wake_event.clear()
+    self.logger.debug("  Executed runner's time out")
+
+  async def shutdown(self):
+    '''
+      Called once the loop has ended, release app resources here
+    '''
+    pass
+
+  async def loop(self, app_func, hint_func = None):
+    '''
+      Runs one app function on its own schedule
+    '''
+    scheduler  = Scheduler(**self.config)
+    wake_event = asyncio.Event()
+    self.wake_events.append(wake_event)
+    stopper = asyncio.ensure_future(self.stop_event.wait())
+    try:
+      while not self.stop_running:
+        self.logger.debug("  Looping process: [stop_running=%s]"%str(self.stop_running))
+
+        # a signal cancels the cycle in progress
+        start_time = time.time()
+        cycle = asyncio.ensure_future(self.call_app(app_func))
+        await asyncio.wait({cycle, stopper}, return_when=asyncio.FIRST_COMPLETED)
+        if not cycle.done():
+          cycle.cancel()
+          await asyncio.gather(cycle, return_exceptions=True)
+          break
+
+        ok = cycle.result()
+        hint = hint_func() if hint_func else None
+        delay = scheduler.next_delay(ok, hint)
+        if not ok:
+          self.logger.debug("  App function failed to execute, sleeping %d"%delay)
+          await self.timeout(delay, wake_event)
+        else:
+          elapsed = time.time() - start_time
+          await self.timeout(delay - elapsed, wake_event)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      stopper.cancel()
+
+  async def run(self):
+    try:
+      self.logger.debug("  Running event loop")
+      self.stop_event = asyncio.Event()
+      loop = asyncio.get_running_loop()
+      loop.add_signal_handler(SIGTERM, self.signal_handler)
+      loop.add_signal_handler(SIGINT,  self.signal_handler)
+      loop.add_signal_handler(SIGUSR1, self.wakeup_handler)
+      if self.wakeup_path:
+        sock = wakeup_socket(self.wakeup_path)
+        loop.add_reader(sock.fileno(), self.wakeup_message, sock)
+        self.logger.debug("  Listening wake-up messages in %s"%self.wakeup_path)
+
+      # a list of app functions are looped concurrently
+      app_funcs  = self.app_func
+      hint_funcs = self.hint_func
+      if not isinstance(app_funcs, list):
+        app_funcs  = [app_funcs]
+        hint_funcs = [hint_funcs]
+      if not isinstance(hint_funcs, list):
+        hint_funcs = [None] * len(app_funcs)
+      await asyncio.gather(*[self.loop(app_func, hint_func)
+                             for app_func, hint_func in zip(app_funcs, hint_funcs)])
+
+      await self.shutdown()
+      self.logger.info("Runner has been ended")
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
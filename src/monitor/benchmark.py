@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import resource
+import requests
+import utilities
+import subprocess
+import multiprocessing
+
+from optparse import OptionParser
+
+TRACKERS = ['udp://tracker-%d.example:1337/announce'%index for index in range(16)]
+
+def percentile(samples, share):
+  if len(samples) < 1:
+    return 0.0
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(share * len(samples)))]
+
+def serve_fake(options, ports):
+  # server runs in its own process so it does not count in peak RSS
+  from fake_qbittorrent import FakeQBittorrent
+  logging.getLogger().setLevel(logging.WARNING)
+  fake = FakeQBittorrent(**options)
+  ports.put(fake.serve(0))
+  while True:
+    time.sleep(3600)
+
+class Benchmark:
+  '''
+    Runs monitor cycles against a local fake qBittorrent with a given
+    number of torrents, collects cycle time, requests, bytes, peak RSS
+    and API call latency
+  '''
+  def __init__(self, **kwargs):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.options  = kwargs
+    self.cycles   = kwargs.get('cycles') or 5
+    self.async_mode = bool(kwargs.get('async_mode'))
+    self.server   = None
+    self.port     = None
+
+  def start_server(self, torrents):
+    options = dict(self.options)
+    options.update({'torrents': torrents, 'user': 'admin', 'access': 'admin'})
+    ports = multiprocessing.Queue()
+    self.server = multiprocessing.Process(target=serve_fake, args=(options, ports),
+                                          daemon=True)
+    self.server.start()
+    self.port = ports.get(timeout=600)
+
+  def stop_server(self):
+    if self.server is not None:
+      self.server.terminate()
+      self.server.join()
+      self.server = None
+
+  def server_stats(self):
+    response = requests.get('http://127.0.0.1:%d/bench/stats'%self.port)
+    return response.json()
+
+  def monitor(self):
+    import qbitorrent
+
+    options = dict(self.options)
+    options.update({'host': '127.0.0.1', 'port': self.port,
+                    'user': 'admin', 'access': 'admin'})
+    monitor = qbitorrent.QBitorrentMonitor(**options)
+
+    # every call latency is kept, histogram buckets are too coarse
+    samples = {}
+    observe_call = monitor.metrics.observe_call
+    def observe(endpoint, seconds, failed = False):
+      samples.setdefault(endpoint, []).append(seconds)
+      observe_call(endpoint, seconds, failed)
+    monitor.metrics.observe_call = observe
+    monitor.samples = samples
+
+    # tracker list is fixed, nothing is downloaded
+    monitor.trackers.set_trackers(TRACKERS)
+    monitor.trackers.last_update = time.time()
+    return monitor
+
+  def run_cycles(self, monitor):
+    elapsed = []
+    if self.async_mode:
+      async def cycles():
+        for cycle in range(self.cycles):
+          start = time.perf_counter()
+          await monitor.async_update()
+          elapsed.append(time.perf_counter() - start)
+        await monitor.client.close()
+      asyncio.run(cycles())
+    else:
+      for cycle in range(self.cycles):
+        start = time.perf_counter()
+        monitor.update()
+        elapsed.append(time.perf_counter() - start)
+    return elapsed
+
+  def run(self, torrents):
+    result = None
+    try:
+      self.start_server(torrents)
+      monitor = self.monitor()
+      elapsed = self.run_cycles(monitor)
+      stats = self.server_stats()
+
+      latencies = [seconds for values in monitor.samples.values() for seconds in values]
+      result = {
+        'torrents':   torrents,
+        'cycles':     len(elapsed),
+        'first':      elapsed[0],
+        'cycle_p50':  percentile(elapsed[1:] or elapsed, 0.5),
+        'cycle_max':  max(elapsed),
+        'requests':   stats['requests'],
+        'bytes_in':   stats['bytes_in'],
+        'bytes_out':  stats['bytes_out'],
+        'peak_rss':   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'call_p50':   percentile(latencies, 0.5),
+        'call_p99':   percentile(latencies, 0.99),
+        'endpoints':  dict([(endpoint, {'count': len(values),
+                                        'p50': percentile(values, 0.5),
+                                        'p99': percentile(values, 0.99)})
+                            for endpoint, values in monitor.samples.items()])
+      }
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      self.stop_server()
+      return result
+
+  def report(self, result):
+    self.logger.info("%6d torrents: first %.3fs, p50 %.3fs, max %.3fs per cycle, "
+                     "%d requests, %s sent, %s received, peak RSS %s, "
+                     "call p50 %.1fms p99 %.1fms"%
+                     (result['torrents'], result['first'], result['cycle_p50'],
+                      result['cycle_max'], result['requests'],
+                      utilities.human_readable_data(result['bytes_in']),
+                      utilities.human_readable_data(result['bytes_out']),
+                      utilities.human_readable_data(result['peak_rss']),
+                      result['call_p50'] * 1000, result['call_p99'] * 1000))
+    for endpoint, call in sorted(result['endpoints'].items()):
+      self.logger.info("    %-22s %6d calls, p50 %.1fms p99 %.1fms"%
+                       (endpoint, call['count'], call['p50'] * 1000, call['p99'] * 1000))
+
+# entry points as (directory next to this one, module)
+ENTRY_POINTS = [('monitor', 'qbitorrent'), ('backuper', 'backuper')]
+
+def startup_time(directory, module, runs):
+  '''
+    Median seconds to start an interpreter and to import a module
+    in it, with slowest direct imports of the module
+  '''
+  path  = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', directory)
+  code  = "import time; start = time.perf_counter(); import %s; "\
+          "print(time.perf_counter() - start)"%module
+  total = []
+  imports = []
+  for run in range(runs):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], cwd=path, check=True,
+                            capture_output=True, text=True).stdout
+    total.append(time.perf_counter() - start)
+    imports.append(float(output.split()[-1]))
+
+  # imports are listed before the one importing them, direct
+  # imports of the module are nested once right before it
+  trace = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s'%module],
+                         cwd=path, check=True, capture_output=True, text=True).stderr
+  slowest = []
+  children = []
+  for line in trace.splitlines():
+    fields = line.split('|')
+    if len(fields) != 3:
+      continue
+    name = fields[2].strip()
+    depth = (len(fields[2]) - len(fields[2].lstrip())) // 2
+    if depth == 1:
+      children.append((int(fields[1]) / 1e6, name))
+    elif depth == 0:
+      if name == module:
+        slowest = sorted(children, reverse=True)
+      children = []
+
+  return {
+    'module':  module,
+    'runs':    runs,
+    'startup': percentile(total, 0.5),
+    'import':  percentile(imports, 0.5),
+    'slowest': slowest[:5]
+  }
+
+def report_startup(logger, result):
+  logger.info("%-12s start %.3fs, import %.3fs, slowest: %s"%
+              (result['module'], result['startup'], result['import'],
+               ', '.join(["%s %.1fms"%(name, seconds * 1000)
+                          for seconds, name in result['slowest']])))
+
+def run_isolated(options, torrents, results):
+  # peak RSS is only meaningful in a fresh process
+  results.put(Benchmark(**options).run(torrents))
+
+if __name__ == '__main__':
+  logFormatter="'%(asctime)s|%(name)-15s|%(levelname)7s|%(message)s'"
+  logging.basicConfig(format=logFormatter, level=logging.WARNING)
+  logger = utilities.GetLogger('Benchmark')
+  logger.setLevel(logging.INFO)
+
+  usage = "usage: %prog [options]"
+  parser = OptionParser(usage=usage)
+  parser.add_option('--torrents',
+                type="string",
+                action='store',
+                default='1000,10000,50000',
+                help='Comma separated torrent counts to run')
+  parser.add_option('--cycles',
+                type="int",
+                action='store',
+                default=5,
+                help='Monitor cycles per torrent count')
+  parser.add_option('--latency',
+                type="float",
+                action='store',
+                default=0.0,
+                help='Seconds added by fake server to every request')
+  parser.add_option('--churn',
+                type="float",
+                action='store',
+                default=0.05,
+                help='Share of downloading torrents changed per listing')
+  parser.add_option('--sync_mode',
+                type="int",
+                action='store',
+                default=None,
+                help='Poll with sync/maindata deltas')
+  parser.add_option('--async_mode',
+                type="int",
+                action='store',
+                default=None,
+                help='Run async monitor cycle')
+  parser.add_option('--batch_size',
+                type="int",
+                action='store',
+                default=None,
+                help='Maximum torrents per grouped action')
+  parser.add_option('--startup',
+                type="int",
+                action='store',
+                default=None,
+                help='Measure start up time of entry points over given runs')
+  parser.add_option('--max_startup',
+                type="float",
+                action='store',
+                default=None,
+                help='Fail if an entry point takes longer to import')
+  parser.add_option('--json',
+                action='store_true',
+                default=False,
+                help='Print results as JSON lines')
+  (options, args) = parser.parse_args()
+
+  if options.startup:
+    failed = False
+    for directory, module in ENTRY_POINTS:
+      result = startup_time(directory, module, options.startup)
+      if options.json:
+        print(json.dumps(result, separators=(',', ':')))
+      else:
+        report_startup(logger, result)
+      if options.max_startup and result['import'] > options.max_startup:
+        logger.warning("Importing %s takes %.3fs, over %.3fs"%
+                       (module, result['import'], options.max_startup))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+  option_dict = dict([(key, value) for key, value in vars(options).items()
+                      if value is not None])
+  counts = [int(count) for count in options.torrents.split(',') if count.strip()]
+  option_dict.pop('torrents')
+
+  for count in counts:
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_isolated,
+                                      args=(option_dict, count, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if result is None:
+      logger.warning("Benchmark of %d torrents failed"%count)
+      continue
+    if options.json:
+      print(json.dumps(result, separators=(',', ':')))
+    else:
+      Benchmark(**option_dict).report(result)
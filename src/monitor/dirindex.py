@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import os
+import time
+import utilities
+
+try:
+  from inotify_simple import INotify, flags
+except ImportError:
+  INotify = None
+
+class DirectoryIndex:
+  '''
+    Sizes of top level entries of download directories, so content
+    of a torrent is looked up without touching the storage. A
+    directory is scanned again when its mtime changes, entries with
+    the same mtime keep their size. Everything is scanned again every
+    refresh seconds, as in-place writes do not change any mtime.
+    Local changes are picked up with inotify when available.
+  '''
+  def __init__(self, **kwargs):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.check    = 30
+    self.refresh  = 600
+    self.roots    = {}
+    self.watches  = {}
+    self.inotify  = None
+    try:
+      for key in kwargs.keys():
+        if key == "index_check" and kwargs[key] is not None:
+          self.check = kwargs[key]
+        elif key == "index_refresh" and kwargs[key]:
+          self.refresh = kwargs[key]
+
+      if INotify is not None:
+        self.inotify = INotify()
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def size(self, path):
+    '''
+      Bytes of a file or all files under a directory
+    '''
+    total = 0
+    try:
+      if not os.path.isdir(path):
+        return os.stat(path).st_size
+      with os.scandir(path) as entries:
+        for entry in entries:
+          if entry.is_dir(follow_symlinks=False):
+            total += self.size(entry.path)
+          elif entry.is_file():
+            total += entry.stat().st_size
+    except OSError:
+      pass
+    return total
+
+  def scan(self, path, root, force = False):
+    entries = {}
+    with os.scandir(path) as found:
+      for entry in found:
+        try:
+          mtime = entry.stat().st_mtime
+        except OSError:
+          continue
+        known = root['entries'].get(entry.name)
+        if not force and known is not None and known[0] == mtime:
+          entries[entry.name] = known
+        elif entry.is_dir():
+          entries[entry.name] = (mtime, self.size(entry.path))
+        else:
+          entries[entry.name] = (mtime, entry.stat().st_size)
+    root['entries'] = entries
+
+  def watch(self, path):
+    if self.inotify is None or path in self.watches.values():
+      return
+    try:
+      mask = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | \
+             flags.CLOSE_WRITE
+      self.watches[self.inotify.add_watch(path, mask)] = path
+    except OSError as inst:
+      # remote file systems might not support it
+      self.logger.debug("    Not watching %s: %s"%(path, str(inst)))
+
+  def events(self):
+    '''
+      Updates entries changed locally since last call, meant to be
+      called once per cycle
+    '''
+    if self.inotify is None or not self.watches:
+      return
+    for event in self.inotify.read(timeout=0):
+      path = self.watches.get(event.wd)
+      root = self.roots.get(path)
+      if root is None or not event.name:
+        continue
+      entry_path = os.path.join(path, event.name)
+      if event.mask & (flags.DELETE | flags.MOVED_FROM):
+        root['entries'].pop(event.name, None)
+        continue
+      try:
+        root['entries'][event.name] = (os.stat(entry_path).st_mtime, self.size(entry_path))
+      except OSError:
+        root['entries'].pop(event.name, None)
+
+  def root(self, path):
+    '''
+      Index of a directory, checked at most every check seconds
+    '''
+    now  = time.time()
+    root = self.roots.get(path)
+    if root is not None and now - root['checked'] < self.check:
+      return root
+
+    if root is None:
+      root = {'mtime': None, 'scanned': 0, 'checked': 0, 'entries': {}}
+      self.roots[path] = root
+      self.watch(path)
+    root['checked'] = now
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      root['mtime'] = None
+      root['entries'] = {}
+      return root
+
+    force = now - root['scanned'] >= self.refresh
+    if force or mtime != root['mtime']:
+      start = time.time()
+      self.scan(path, root, force)
+      root['mtime']   = mtime
+      if force:
+        root['scanned'] = now
+      self.logger.debug("    Indexed %d entries of %s in %.3fs"%
+                        (len(root['entries']), path, time.time() - start))
+    return root
+
+  def present(self, path, name, size = None):
+    '''
+      Whether an entry exists in a directory with at least the
+      expected size, sizes are not checked when unknown
+    '''
+    entry = self.root(path)['entries'].get(name)
+    if entry is None:
+      return False
+    return not size or entry[1] >= size
+
+  def close(self):
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import json
+import time
+import random
+import logging
+import threading
+import utilities
+
+from optparse import OptionParser
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+API = '/api/v2/'
+SID = 'benchmark'
+
+class FakeQBittorrent:
+  '''
+    Local stand-in of qBittorrent Web API holding a synthetic torrent
+    table, every listing moves a share of torrents along. Requests and
+    bytes are counted and can be delayed by a fixed latency.
+  '''
+  def __init__(self, **kwargs):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.count    = 1000
+    self.latency  = 0.0
+    self.churn    = 0.05
+    self.user     = 'admin'
+    self.access   = 'admin'
+    self.lock     = threading.Lock()
+    self.torrents = {}
+    self.trackers = {}
+    self.changed  = set()
+    self.rid      = 0
+    self.stats    = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'endpoints': {}}
+    try:
+      for key in kwargs.keys():
+        if key == "torrents" and kwargs[key]:
+          self.count = kwargs[key]
+        elif key == "latency" and kwargs[key]:
+          self.latency = kwargs[key]
+        elif key == "churn" and kwargs[key] is not None:
+          self.churn = kwargs[key]
+        elif key == "user" and kwargs[key]:
+          self.user = kwargs[key]
+        elif key == "access" and kwargs[key]:
+          self.access = kwargs[key]
+
+      self.random = random.Random(kwargs.get('seed', 0))
+      self.populate()
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def populate(self):
+    '''
+      Mix of downloading, seeding, paused and long stalled torrents
+    '''
+    now = time.time()
+    states = [('downloading', 0.2), ('uploading', 0.5),
+              ('pausedDL', 0.2), ('stalledDL', 0.1)]
+    for index in range(self.count):
+      infohash = '%040x'%self.random.getrandbits(160)
+      pick  = self.random.random()
+      state = states[-1][0]
+      for name, share in states:
+        if pick < share:
+          state = name
+          break
+        pick -= share
+
+      size     = self.random.randint(2**20, 2**34)
+      progress = 1.0 if state == 'uploading' else round(self.random.random(), 4)
+      self.torrents[infohash] = {
+        'hash':           infohash,
+        'name':           'torrent-%06d'%index,
+        'state':          state,
+        'progress':       progress,
+        'size':           size,
+        'downloaded':     int(size * progress),
+        'dlspeed':        self.random.randint(1, 2**22) if state == 'downloading' else 0,
+        'num_seeds':      self.random.randint(0, 50) if state != 'stalledDL' else 0,
+        'num_leechs':     self.random.randint(0, 50) if state != 'stalledDL' else 0,
+        'ratio':          round(self.random.random() * 3, 3),
+        'seeding_time':   self.random.randint(0, 3600*24*60) if progress == 1 else 0,
+        'last_activity':  now - (3600*24*400 if state == 'stalledDL' else self.random.randint(0, 3600)),
+        'trackers_count': 1,
+      }
+      self.trackers[infohash] = ['udp://tracker-%d.example:1337/announce'%(index % 16)]
+
+  def tick(self):
+    '''
+      Moves a share of active torrents, called on each listing
+    '''
+    active = [infohash for infohash, torrent in self.torrents.items()
+              if torrent['state'] == 'downloading']
+    now = time.time()
+    for infohash in self.random.sample(active, int(len(active) * self.churn)):
+      torrent = self.torrents[infohash]
+      torrent['progress'] = min(1.0, round(torrent['progress'] + self.random.random() / 20, 4))
+      torrent['downloaded'] = int(torrent['size'] * torrent['progress'])
+      torrent['dlspeed'] = self.random.randint(0, 2**22)
+      torrent['last_activity'] = now
+      self.changed.add(infohash)
+    self.rid += 1
+
+  def sync_main_data(self, rid):
+    # actions posted since last listing are part of the delta
+    self.tick()
+    changed, self.changed = self.changed, set()
+    if rid == 0 or rid != self.rid - 1:
+      return {'rid': self.rid, 'full_update': True, 'torrents': self.torrents}
+    return {'rid': self.rid,
+            'torrents': dict([(infohash, self.torrents[infohash])
+                              for infohash in changed])}
+
+  def set_state(self, hashes, paused):
+    for infohash in hashes.split('|'):
+      torrent = self.torrents.get(infohash)
+      if torrent is None:
+        continue
+      suffix = 'UP' if torrent['progress'] == 1 else 'DL'
+      torrent['state'] = ('paused' if paused else 'stalled') + suffix
+      self.changed.add(infohash)
+
+  def add_trackers(self, infohash, urls):
+    current = self.trackers.get(infohash)
+    if current is None:
+      return
+    for url in urls.split('\n'):
+      if url and url not in current:
+        current.append(url)
+    self.torrents[infohash]['trackers_count'] = len(current)
+    self.changed.add(infohash)
+
+  def get(self, endpoint, query):
+    if endpoint == 'app/version':
+      return 'v4.6.0'
+    elif endpoint == 'app/webapiVersion':
+      return '2.9.3'
+    elif endpoint == 'app/preferences':
+      return {}
+    elif endpoint == 'torrents/info':
+      self.tick()
+      return list(self.torrents.values())
+    elif endpoint == 'sync/maindata':
+      return self.sync_main_data(int(query.get('rid', ['0'])[0]))
+    elif endpoint == 'torrents/trackers':
+      urls = self.trackers.get(query.get('hash', [''])[0], [])
+      return [{'url': '** [DHT] **', 'status': 0}] + \
+             [{'url': url, 'status': 2} for url in urls]
+    return None
+
+  def post(self, endpoint, form):
+    value = lambda name: form.get(name, [''])[0]
+    if endpoint == 'torrents/pause':
+      self.set_state(value('hashes'), True)
+    elif endpoint == 'torrents/resume':
+      self.set_state(value('hashes'), False)
+    elif endpoint == 'torrents/recheck':
+      self.set_state(value('hashes'), False)
+    elif endpoint == 'torrents/addTrackers':
+      self.add_trackers(value('hash'), value('urls'))
+    else:
+      return None
+    return ''
+
+  def count_request(self, endpoint, bytes_in, bytes_out):
+    with self.lock:
+      self.stats['requests']  += 1
+      self.stats['bytes_in']  += bytes_in
+      self.stats['bytes_out'] += bytes_out
+      self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+  def handler(self):
+    fake = self
+
+    class FakeHandler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      # headers and body go out in separate writes
+      disable_nagle_algorithm = True
+
+      def log_message(self, format, *args):
+        pass
+
+      def reply(self, endpoint, body, code = 200, headers = {}, bytes_in = 0):
+        if not isinstance(body, str):
+          body = json.dumps(body)
+        data = body.encode('utf-8')
+        self.send_response(code)
+        for name, value in headers.items():
+          self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if endpoint != 'bench/stats':
+          fake.count_request(endpoint, bytes_in, len(data))
+
+      def authorised(self):
+        return ('SID=%s'%SID) in self.headers.get('Cookie', '')
+
+      def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = url.path[len(API):] if url.path.startswith(API) else url.path.strip('/')
+        if endpoint == 'bench/stats':
+          with fake.lock:
+            return self.reply(endpoint, fake.stats)
+        if fake.latency:
+          time.sleep(fake.latency)
+        if not self.authorised():
+          return self.reply(endpoint, 'Forbidden', 403)
+
+        # torrents are serialised before other requests change them
+        with fake.lock:
+          body = fake.get(endpoint, parse_qs(url.query))
+          if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+        if body is None:
+          return self.reply(endpoint, 'Not Found', 404)
+        self.reply(endpoint, body)
+
+      def do_POST(self):
+        url = urlparse(self.path)
+        endpoint = url.path[len(API):]
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if fake.latency:
+          time.sleep(fake.latency)
+
+        if endpoint == 'auth/login':
+          if form.get('username', [''])[0] == fake.user and \
+             form.get('password', [''])[0] == fake.access:
+            return self.reply(endpoint, 'Ok.',
+                              headers={'Set-Cookie': 'SID=%s; path=/'%SID},
+                              bytes_in=length)
+          return self.reply(endpoint, 'Fails.', bytes_in=length)
+        if not self.authorised():
+          return self.reply(endpoint, 'Forbidden', 403, bytes_in=length)
+
+        with fake.lock:
+          body = fake.post(endpoint, form)
+        if body is None:
+          return self.reply(endpoint, 'Not Found', 404, bytes_in=length)
+        self.reply(endpoint, body, bytes_in=length)
+
+    return FakeHandler
+
+  def serve(self, port = 0, host = '127.0.0.1'):
+    '''
+      Serves in a daemon thread, returns the bound port
+    '''
+    self.server = ThreadingHTTPServer((host, port), self.handler())
+    self.server.daemon_threads = True
+    thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    thread.start()
+    self.logger.info("Serving %d torrents on %s:%d"%
+                     (len(self.torrents), host, self.server.server_port))
+    return self.server.server_port
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+if __name__ == '__main__':
+  logFormatter="'%(asctime)s|%(name)-15s|%(levelname)7s|%(message)s'"
+  logging.basicConfig(format=logFormatter, level=logging.INFO)
+
+  usage = "usage: %prog [options]"
+  parser = OptionParser(usage=usage)
+  parser.add_option('--port',
+                type="int",
+                action='store',
+                default=8080,
+                help='Port to serve on')
+  parser.add_option('--torrents',
+                type="int",
+                action='store',
+                default=1000,
+                help='Number of synthetic torrents')
+  parser.add_option('--latency',
+                type="float",
+                action='store',
+                default=0.0,
+                help='Seconds added to every request')
+  parser.add_option('--churn',
+                type="float",
+                action='store',
+                default=0.05,
+                help='Share of downloading torrents changed per listing')
+  (options, args) = parser.parse_args()
+
+  fake = FakeQBittorrent(**vars(options))
+  fake.serve(options.port, '0.0.0.0')
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    fake.stop()
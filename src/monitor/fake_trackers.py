@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import time
+import struct
+import logging
+import threading
+import socketserver
+import utilities
+
+from optparse import OptionParser
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from tracker_health import UDP_PROTOCOL_ID, UDP_CONNECT
+
+# BEP 15 announce
+UDP_ANNOUNCE = 1
+
+class FakeTracker:
+  '''
+    Common options of local stand-in trackers: replies are delayed
+    by latency seconds, or never sent when silent
+  '''
+  def __init__(self, **kwargs):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.latency  = 0.0
+    self.silent   = False
+    self.server   = None
+    self.requests = 0
+    self.stopped  = threading.Event()
+    try:
+      for key in kwargs.keys():
+        if key == "latency" and kwargs[key]:
+          self.latency = kwargs[key]
+        elif key == "silent":
+          self.silent = bool(kwargs[key])
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def answer(self):
+    '''
+      Waits as configured, returns False if nothing is to be sent
+    '''
+    self.requests += 1
+    if self.silent:
+      return False
+    if self.latency:
+      time.sleep(self.latency)
+    return True
+
+  def start(self, server):
+    self.server = server
+    self.server.daemon_threads = True
+    thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    thread.start()
+    self.logger.info("Serving on %s:%d"%self.server.server_address[:2])
+    return self.server.server_address[1]
+
+  def stop(self):
+    self.stopped.set()
+    self.server.shutdown()
+    self.server.server_close()
+
+class FakeUdpTracker(FakeTracker):
+  '''
+    Answers BEP 15 connect and announce requests
+  '''
+  def handler(self):
+    fake = self
+
+    class UdpHandler(socketserver.BaseRequestHandler):
+      def handle(self):
+        data, sock = self.request
+        if len(data) < 16 or not fake.answer():
+          return
+        connection_id, action, transaction = struct.unpack('>QII', data[:16])
+        if action == UDP_CONNECT and connection_id == UDP_PROTOCOL_ID:
+          # connection id is only checked by announces
+          sock.sendto(struct.pack('>IIQ', UDP_CONNECT, transaction, fake.connection_id),
+                      self.client_address)
+        elif action == UDP_ANNOUNCE and connection_id == fake.connection_id:
+          # interval, leechers and seeders, without peers
+          sock.sendto(struct.pack('>IIIII', UDP_ANNOUNCE, transaction, 1800, 0, 0),
+                      self.client_address)
+
+    return UdpHandler
+
+  def serve(self, port = 0, host = '127.0.0.1'):
+    '''
+      Serves in a daemon thread, returns the bound port
+    '''
+    self.connection_id = 0x5eed
+    return self.start(socketserver.ThreadingUDPServer((host, port), self.handler()))
+
+class FakeHttpTracker(FakeTracker):
+  '''
+    Answers announces on /announce with an empty peer list, a given
+    status code stands for a broken tracker
+  '''
+  def __init__(self, **kwargs):
+    FakeTracker.__init__(self, **kwargs)
+    self.status = kwargs.get('status') or 200
+
+  def handler(self):
+    fake = self
+
+    class HttpHandler(BaseHTTPRequestHandler):
+      def log_message(self, format, *args):
+        pass
+
+      def do_GET(self):
+        if not fake.answer():
+          # connection is held until the client gives up
+          fake.stopped.wait(3600)
+          return
+        url   = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path != '/announce':
+          code, body = 404, b'not found'
+        elif 'info_hash' not in query or 'peer_id' not in query:
+          code, body = 400, b'd14:failure reason16:missing argumente'
+        else:
+          code, body = fake.status, b'd8:intervali1800e5:peers0:e'
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    return HttpHandler
+
+  def serve(self, port = 0, host = '127.0.0.1'):
+    '''
+      Serves in a daemon thread, returns the bound port
+    '''
+    return self.start(ThreadingHTTPServer((host, port), self.handler()))
+
+if __name__ == '__main__':
+  logFormatter="'%(asctime)s|%(name)-15s|%(levelname)7s|%(message)s'"
+  logging.basicConfig(format=logFormatter, level=logging.INFO)
+
+  usage = "usage: %prog [options]"
+  parser = OptionParser(usage=usage)
+  parser.add_option('--udp_port',
+                type="int",
+                action='store',
+                default=6969,
+                help='Port of UDP tracker')
+  parser.add_option('--http_port',
+                type="int",
+                action='store',
+                default=6970,
+                help='Port of HTTP tracker')
+  parser.add_option('--latency',
+                type="float",
+                action='store',
+                default=None,
+                help='Seconds added to every answer')
+  (options, args) = parser.parse_args()
+
+  udp  = FakeUdpTracker(latency=options.latency)
+  http = FakeHttpTracker(latency=options.latency)
+  udp.serve(options.udp_port)
+  http.serve(options.http_port)
+  while True:
+    time.sleep(3600)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import os
+import time
+import bisect
+import asyncio
+import threading
+import utilities
+
+BUCKETS  = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+REGISTRY = []
+SERVER   = {'pid': None, 'server': None}
+
+class Timer:
+  '''
+    Adds elapsed time of a block to a phase
+  '''
+  __slots__ = ('metrics', 'name', 'start')
+
+  def __init__(self, metrics, name):
+    self.metrics = metrics
+    self.name    = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.metrics.add_phase(self.name, time.perf_counter() - self.start)
+    return False
+
+class Metrics:
+  '''
+    Counters of one monitored instance: phase times, API calls per
+    endpoint with latency histogram, torrents and actions, and gauges
+    of latest values
+  '''
+  def __init__(self, instance = ''):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.instance = instance
+    self.cycles   = 0
+    self.torrents = 0
+    self.actions  = {}
+    self.phases   = {}
+    self.calls    = {}
+    self.gauges   = {}
+    self.cycle    = {}
+    self.cycle_calls = 0
+
+  def phase(self, name):
+    return Timer(self, name)
+
+  def add_phase(self, name, seconds):
+    total = self.phases.get(name, 0.0)
+    self.phases[name] = total + seconds
+    self.cycle[name]  = self.cycle.get(name, 0.0) + seconds
+
+  def observe_call(self, endpoint, seconds, failed = False):
+    call = self.calls.get(endpoint)
+    if call is None:
+      call = {'count': 0, 'errors': 0, 'sum': 0.0,
+              'buckets': [0] * (len(BUCKETS) + 1)}
+      self.calls[endpoint] = call
+    call['count'] += 1
+    call['sum']   += seconds
+    call['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+    if failed:
+      call['errors'] += 1
+
+  def set_gauge(self, name, value):
+    self.gauges[name] = value
+
+  def start_cycle(self):
+    self.cycle = {}
+    self.cycle_calls = sum([call['count'] for call in self.calls.values()])
+
+  def end_cycle(self, torrents, actions):
+    '''
+      Returns a one line summary of the cycle
+    '''
+    self.cycles  += 1
+    self.torrents += torrents
+    self.actions  = dict(actions)
+    calls = sum([call['count'] for call in self.calls.values()]) - self.cycle_calls
+    phases = ' '.join(["%s=%.3fs"%(name, seconds)
+                       for name, seconds in self.cycle.items()])
+    gauges = ''.join([" %s=%s"%(name, value) for name, value in self.gauges.items()])
+    return "cycle %.3fs [%s] torrents=%d calls=%d%s"% \
+           (sum(self.cycle.values()), phases, torrents, calls, gauges)
+
+  def render(self):
+    '''
+      Prometheus text exposition lines of this instance
+    '''
+    label = 'instance="%s"'%self.instance
+    lines = [
+      'monitor_cycles_total{%s} %d'%(label, self.cycles),
+      'monitor_torrents_processed_total{%s} %d'%(label, self.torrents),
+    ]
+    for name, seconds in list(self.phases.items()):
+      lines.append('monitor_phase_seconds_total{%s,phase="%s"} %.6f'%
+                   (label, name, seconds))
+    for name, value in list(self.gauges.items()):
+      lines.append('monitor_%s{%s} %s'%(name, label, value))
+    for action, count in list(self.actions.items()):
+      lines.append('monitor_actions_total{%s,action="%s"} %d'%
+                   (label, action, count))
+    for endpoint, call in list(self.calls.items()):
+      call_label = '%s,endpoint="%s"'%(label, endpoint)
+      lines.append('monitor_api_calls_total{%s} %d'%(call_label, call['count']))
+      lines.append('monitor_api_errors_total{%s} %d'%(call_label, call['errors']))
+      cumulative = 0
+      for bound, count in zip(BUCKETS + ['+Inf'], call['buckets']):
+        cumulative += count
+        lines.append('monitor_api_call_seconds_bucket{%s,le="%s"} %d'%
+                     (call_label, bound, cumulative))
+      lines.append('monitor_api_call_seconds_sum{%s} %.6f'%(call_label, call['sum']))
+      lines.append('monitor_api_call_seconds_count{%s} %d'%(call_label, call['count']))
+    return lines
+
+class InstrumentedClient:
+  '''
+    Wraps a qBittorrent client so each API method call is timed,
+    coroutine methods are timed once awaited
+  '''
+  def __init__(self, client, metrics):
+    self.__dict__['client']  = client
+    self.__dict__['metrics'] = metrics
+
+  def __getattr__(self, name):
+    attribute = getattr(self.client, name)
+    if not callable(attribute):
+      return attribute
+    metrics = self.metrics
+
+    if asyncio.iscoroutinefunction(attribute):
+      async def timed_coroutine(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+          result = await attribute(*args, **kwargs)
+        except Exception:
+          metrics.observe_call(name, time.perf_counter() - start, True)
+          raise
+        metrics.observe_call(name, time.perf_counter() - start)
+        return result
+      return timed_coroutine
+
+    def timed(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        result = attribute(*args, **kwargs)
+      except Exception:
+        metrics.observe_call(name, time.perf_counter() - start, True)
+        raise
+      metrics.observe_call(name, time.perf_counter() - start)
+      return result
+    return timed
+
+  def __setattr__(self, name, value):
+    setattr(self.client, name, value)
+
+def register(metrics):
+  REGISTRY.append(metrics)
+
+def render():
+  lines = [
+    '# TYPE monitor_cycles_total counter',
+    '# TYPE monitor_torrents_processed_total counter',
+    '# TYPE monitor_phase_seconds_total counter',
+    '# TYPE monitor_actions_total counter',
+    '# TYPE monitor_api_calls_total counter',
+    '# TYPE monitor_api_errors_total counter',
+    '# TYPE monitor_api_call_seconds histogram',
+  ]
+  for metrics in list(REGISTRY):
+    lines.extend(metrics.render())
+  return "\n".join(lines) + "\n"
+
+def handler():
+  # HTTP server is only loaded when metrics are served
+  from http.server import BaseHTTPRequestHandler
+
+  class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path.split('?')[0] not in ('/', '/metrics'):
+        self.send_error(404)
+        return
+      body = render().encode('utf-8')
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/plain; version=0.0.4')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+
+  return MetricsHandler
+
+def serve(port, host = '0.0.0.0'):
+  '''
+    Starts metrics endpoint once in the process running the cycles
+  '''
+  if SERVER['pid'] == os.getpid():
+    return SERVER['server']
+
+  logger = utilities.GetLogger('Metrics')
+  try:
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host, int(port)), handler())
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    SERVER.update({'pid': os.getpid(), 'server': server})
+    logger.info("Serving metrics on port %s"%str(port))
+  except Exception as inst:
+    # do not try again on every cycle
+    SERVER.update({'pid': os.getpid(), 'server': None})
+    utilities.ParseException(inst, logger=logger)
+  return SERVER['server']
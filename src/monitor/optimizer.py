@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import utilities
+
+# torrents using a download slot, forced ones are never paused
+ACTIVE_STATES   = ('downloading', 'stalledDL', 'metaDL', 'forcedDL')
+PAUSABLE_STATES = ('downloading', 'stalledDL', 'metaDL')
+
+class SlotOptimizer:
+  '''
+    Keeps downloads within a budget of active slots. Download speed
+    and availability of each torrent are exponentially weighted,
+    lowest yield torrents are paused and the ones paused here are
+    resumed when slots free up or they are expected to do better.
+    Torrents stay as they are for hold_cycles after being switched
+    and a swap needs a margin, so they do not flap.
+  '''
+  def __init__(self, **kwargs):
+    class_name     = self.__class__.__name__
+    self.logger    = utilities.GetLogger(class_name)
+    self.slots     = 0
+    self.alpha     = 0.3
+    self.hold      = 5
+    self.margin    = 1.5
+    self.max_swaps = 2
+    try:
+      for key in kwargs.keys():
+        if key == "active_slots" and kwargs[key]:
+          self.slots = kwargs[key]
+        elif key == "slot_hold_cycles" and kwargs[key]:
+          self.hold = kwargs[key]
+        elif key == "slot_margin" and kwargs[key]:
+          self.margin = kwargs[key]
+        elif key == "slot_swaps" and kwargs[key] is not None:
+          self.max_swaps = kwargs[key]
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def availability(self, torrent):
+    '''
+      Distributed copies, swarm seeds when qBittorrent does not
+      know it as for paused torrents
+    '''
+    copies = torrent.get('availability', -1)
+    if copies is None or copies < 0:
+      copies = torrent.get('num_complete', torrent.get('num_seeds', 0))
+    return min(1.0, max(0.0, float(copies)))
+
+  def observe(self, record, torrent):
+    if torrent["state"] in ACTIVE_STATES:
+      speed = float(torrent["dlspeed"])
+      if record.speed is None:
+        record.speed = speed
+      else:
+        record.speed += self.alpha * (speed - record.speed)
+      record.samples += 1
+
+    availability = self.availability(torrent)
+    if record.availability is None:
+      record.availability = availability
+    else:
+      record.availability += self.alpha * (availability - record.availability)
+
+  def expected(self, record, cycle, prior):
+    '''
+      Yield of a paused torrent grows while it waits, so all of
+      them get a chance sooner or later
+    '''
+    speed = prior if record.speed is None else record.speed
+    waited = 1.0 + float(cycle - record.switched) / self.hold
+    return speed * waited * max(0.1, record.availability or 0.0)
+
+  def run(self, state, client, torrents):
+    '''
+      Queues pause and resume actions for a cycle snapshot, returns
+      number of torrents paused and resumed
+    '''
+    switched = {'pause': 0, 'resume': 0}
+    try:
+      if not self.slots:
+        return
+
+      cycle   = state.cycle
+      active  = []
+      queued  = []
+      # policies already free these slots
+      leaving = client.actions.pending['pause']
+      for torrent in torrents:
+        if torrent["progress"] >= 1 or torrent["hash"] in leaving:
+          continue
+        record = state.set_status(torrent)
+        self.observe(record, torrent)
+        held = cycle - record.switched < self.hold
+        if torrent["state"] in ACTIVE_STATES:
+          if record.managed:
+            # resumed by someone else
+            record.managed = False
+            state.dirty.add(torrent["hash"])
+          active.append((torrent, record, held))
+        elif record.managed and torrent["state"].startswith("paused") and not held:
+          queued.append((torrent, record))
+
+      # unknown speeds are guessed from active ones
+      speeds = [record.speed for _, record, _ in active if record.speed is not None]
+      prior  = sum(speeds) / len(speeds) if speeds else 0.0
+
+      # worst first to pause, best first to resume
+      pausable = [(record.speed or 0.0, torrent, record) for torrent, record, held in active
+                  if not held and record.samples >= self.hold and
+                     torrent["state"] in PAUSABLE_STATES]
+      pausable.sort(key=lambda item: item[0])
+      queued = [(self.expected(record, cycle, prior), torrent, record)
+                for torrent, record in queued]
+      queued.sort(key=lambda item: item[0], reverse=True)
+
+      def pause(item):
+        speed, torrent, record = item
+        client.pause_torrent(torrent["hash"])
+        record.managed  = True
+        record.switched = cycle
+        state.dirty.add(torrent["hash"])
+        switched['pause'] += 1
+        self.logger.info("  = = = Pausing slow [%s] at %s/s"%
+                         (torrent["name"], utilities.human_readable_data(speed)))
+
+      def resume(item):
+        expected, torrent, record = item
+        client.resurme_torrent(torrent["name"], torrent["hash"])
+        record.managed  = False
+        record.switched = cycle
+        record.samples  = 0
+        state.dirty.add(torrent["hash"])
+        switched['resume'] += 1
+        self.logger.info("  = = = Resuming queued [%s] expecting %s/s"%
+                         (torrent["name"], utilities.human_readable_data(expected)))
+
+      # over budget: pause slowest
+      excess = len(active) - self.slots
+      while excess > 0 and pausable:
+        pause(pausable.pop(0))
+        excess -= 1
+
+      # free slots: resume best queued
+      free = self.slots - len(active) + switched['pause']
+      while free > 0 and queued:
+        resume(queued.pop(0))
+        free -= 1
+
+      # swap when a queued one is expected to do clearly better
+      swaps = 0
+      while swaps < self.max_swaps and pausable and queued and \
+            queued[0][0] > self.margin * max(pausable[0][0], 1.0):
+        pause(pausable.pop(0))
+        resume(queued.pop(0))
+        swaps += 1
+
+      self.logger.debug("    Slots %d/%d, paused %d, resumed %d, queued %d"%
+                        (len(active) - switched['pause'] + switched['resume'],
+                         self.slots, switched['pause'], switched['resume'], len(queued)))
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return switched
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import time
+import operator
+import utilities
+import importlib.util
+
+# NumPy is the slowest import of the monitor, it is only loaded
+# once rules are evaluated
+numpy = None
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+# Rules are checked in order and first match wins, a condition compares
+# a torrent field against a number or a named threshold of the engine.
+# Rules with an 'option' are only active when that threshold is set.
+RULES = [
+  {
+    'name':   'finished',
+    'action': 'pause',
+    'when':   [('progress', '==', 1)],
+    'unless_state': ('moving', 'paused')
+  },
+  {
+    'name':   'expired',
+    'action': 'pause',
+    'option': 'pause_expired',
+    'when':   [('dlspeed',    '==', 0),
+               ('num_seeds',  '==', 0),
+               ('num_leechs', '==', 0),
+               ('inactive',   '>=', 'timeout_secs')]
+  },
+  {
+    'name':   'ratio',
+    'action': 'pause',
+    'option': 'max_ratio',
+    'when':   [('progress', '==', 1),
+               ('ratio',    '>=', 'max_ratio')],
+    'unless_state': ('moving', 'paused')
+  },
+  {
+    'name':   'seeding_time',
+    'action': 'pause',
+    'option': 'max_seeding_secs',
+    'when':   [('progress',     '==', 1),
+               ('seeding_time', '>=', 'max_seeding_secs')],
+    'unless_state': ('moving', 'paused')
+  },
+]
+
+OPERATORS = {
+  '==': operator.eq,
+  '>=': operator.ge,
+  '<=': operator.le,
+  '>':  operator.gt,
+  '<':  operator.lt,
+}
+
+class PolicyEngine:
+  '''
+    Evaluates policy rules over a whole cycle snapshot at once,
+    torrent fields are loaded as NumPy columns
+  '''
+  def __init__(self, **kwargs):
+    class_name  = self.__class__.__name__
+    self.logger = utilities.GetLogger(class_name)
+    self.thresholds = {
+      'timeout_secs':     3600*24 * 365,
+      'pause_expired':    None,
+      'max_ratio':        None,
+      'max_seeding_secs': None,
+    }
+    try:
+      for key in kwargs.keys():
+        if key == "timeout_days" and kwargs[key] is not None:
+          self.thresholds['timeout_secs'] = 3600*24 * kwargs[key]
+        elif key == "pause_expired" and kwargs[key]:
+          self.thresholds['pause_expired'] = True
+        elif key == "max_ratio" and kwargs[key] is not None:
+          self.thresholds['max_ratio'] = float(kwargs[key])
+        elif key == "max_seeding_days" and kwargs[key] is not None:
+          self.thresholds['max_seeding_secs'] = 3600*24 * kwargs[key]
+
+      self.rules = [rule for rule in RULES
+                    if 'option' not in rule or \
+                       self.thresholds[rule['option']] is not None]
+      self.fields = set([field for rule in self.rules
+                         for field, _, _ in rule['when']])
+      self.logger.debug("  Active policies: %s"%
+                        ', '.join([rule['name'] for rule in self.rules]))
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def columns(self, torrents):
+    '''
+      Loads fields used by active rules, missing ones read as zero
+    '''
+    count = len(torrents)
+    columns = {}
+    for field in self.fields:
+      source = 'last_activity' if field == 'inactive' else field
+      columns[field] = numpy.fromiter(
+        (torrent.get(source, 0) for torrent in torrents),
+        dtype=numpy.float64, count=count)
+
+    if 'inactive' in columns:
+      columns['inactive'] = time.time() - columns['inactive']
+    columns['state'] = numpy.array(
+      [torrent.get('state', '') for torrent in torrents], dtype=str)
+    return columns
+
+  def mask(self, rule, columns, count):
+    matched = numpy.ones(count, dtype=bool)
+    for field, op, value in rule['when']:
+      if isinstance(value, str):
+        value = self.thresholds[value]
+      matched &= OPERATORS[op](columns[field], value)
+
+    for prefix in rule.get('unless_state', ()):
+      matched &= ~numpy.char.startswith(columns['state'], prefix)
+    return matched
+
+  def evaluate(self, torrents):
+    '''
+      Returns {action: {rule name: [torrent index]}} for a snapshot,
+      every torrent matches at most one rule
+    '''
+    global numpy
+    actions = {}
+    count = len(torrents)
+    if count < 1:
+      return actions
+
+    import numpy
+    columns = self.columns(torrents)
+    pending = numpy.ones(count, dtype=bool)
+    for rule in self.rules:
+      matched = self.mask(rule, columns, count) & pending
+      pending &= ~matched
+      indexes = numpy.flatnonzero(matched)
+      if len(indexes) > 0:
+        actions.setdefault(rule['action'], {})[rule['name']] = indexes.tolist()
+    return actions
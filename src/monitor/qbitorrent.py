@@ -2,22 +2,62 @@
 # -*- coding: latin-1 -*-
 
 LOG_NAME = 'QBitorrent'
+NEAR_COMPLETION = 0.95
+# incomplete torrents not moving, content found on disk is rechecked
+RECHECK_STATES = ('paused', 'stalled', 'missingFiles', 'error', 'queued')
 
 import os
+import sys
 import logging
 import utilities
+import policies
+import timeseries
+import metrics
 import signal
-import requests
+import hashlib
+import asyncio
+import json
 import time
 
 from runner import Runner
+from aiorunner import AsyncRunner
+from store import StateStore
+from policies import PolicyEngine
+from status import StatusRenderer
+from session import CircuitBreaker, SessionClient
+from recorder import Recorder, RecordingClient
+from tracker_health import TrackerHealth
+from optimizer import SlotOptimizer
+from timeseries import TimeSeries
+from dirindex import DirectoryIndex
 from optparse import OptionParser, OptionGroup
-from qbittorrent import Client
-from pprint import pprint
 from datetime import timedelta, datetime
+from collections import namedtuple
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+class TorrentRecord:
+  """
+  Compact per-torrent state, only what the monitor keeps across cycles
+  """
+  __slots__ = ('name', 'last_update_trackers', 'trackers_hash',
+               'trackers', 'update_trackers', 'last_seen',
+               'speed', 'availability', 'samples', 'managed', 'switched')
+
+  def __init__(self, name, cycle = 0):
+    self.name                 = name
+    self.last_update_trackers = None
+    self.trackers_hash        = None
+    self.trackers             = None
+    self.update_trackers      = False
+    self.last_seen            = cycle
+    # download history kept by slot optimizer
+    self.speed                = None
+    self.availability         = None
+    self.samples              = 0
+    self.managed              = False
+    self.switched             = 0
+
 class TorrentState:
   """
   State should be defined by torrent hash as key
@@ -27,9 +67,14 @@ class TorrentState:
     self.logger = utilities.GetLogger(class_name)
     self.status = {}
     self.update_trackers = 0
+    self.cycle        = 0
+    self.evict_cycles = 10
+    self.dirty        = set()
     for key in kwargs.keys():
       if key == "update_trackers":
         self.trackers_timeout = kwargs[key]
+      elif key == "evict_cycles" and kwargs[key]:
+        self.evict_cycles = kwargs[key]
   
   def get_status(self, infohash):
     if infohash in self.status:
@@ -38,41 +83,84 @@ class TorrentState:
       return None
   
   def set_status(self, torrent):
+    record = None
     try:
       infohash = torrent["hash"]
       name = torrent["name"]
-      self.logger.debug("    Added torrent status to [%s]"%name)
-      self.status.update({infohash:torrent})
+      record = self.status.get(infohash)
+      if record is None:
+        self.logger.debug("    Added torrent status to [%s]"%name)
+        record = TorrentRecord(name, self.cycle)
+        self.status[infohash] = record
+        self.dirty.add(infohash)
+      else:
+        record.name = name
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return record
 
-  def update_tracker_ts(self, torrent):
+  def update_tracker_ts(self, torrent, trackers_hash = None):
     try:
 
       infohash = torrent["hash"]
       name = torrent["name"]
       self.logger.debug("    Added trackers to status [%s]"%name)
-      ts = datetime.timestamp(datetime.now())
-      self.status[infohash].update({'last_update_trackers' : ts})
+      record = self.status[infohash]
+      record.last_update_trackers = datetime.timestamp(datetime.now())
+      if trackers_hash is not None:
+        record.trackers_hash = trackers_hash
+      self.dirty.add(infohash)
 
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
+  def get_trackers(self, infohash):
+    record = self.get_status(infohash)
+    if record is None:
+      return None
+    return record.trackers
+
+  def set_trackers(self, torrent, trackers):
+    '''
+      Keeps trackers currently known by torrent, URLs are interned
+      as most torrents share the same ones
+    '''
+    try:
+      record = self.set_status(torrent)
+      record.trackers = frozenset([sys.intern(url) for url in trackers])
+      self.dirty.add(torrent["hash"])
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def add_trackers(self, infohash, trackers):
+    record = self.get_status(infohash)
+    if record is not None and record.trackers is not None:
+      record.trackers = record.trackers.union(
+        [sys.intern(url) for url in trackers])
+      self.dirty.add(infohash)
+
+  def trackers_stale(self, torrent):
+    '''
+      Cached trackers are unknown or do not match torrent tracker count
+    '''
+    current = self.get_trackers(torrent["hash"])
+    if current is None:
+      return True
+    return 'trackers_count' in torrent and \
+           torrent['trackers_count'] != len(current)
+
   def set(self, torrent, trackers = None, set_functor = None):
     try:
       # getting torrent data
-      infohash   = torrent["hash"]
-      if infohash not in self.status or \
-          'update_trackers' not in self.get_status(infohash) or \
-          not self.get_status(infohash)['update_trackers']:
+      record = self.get_status(torrent["hash"])
+      if record is None or not record.update_trackers:
   
         # TODO: what if there is a new torrent without latest available trackers?
         # set to update trackers
-        if infohash in self.status:
-          self.status[infohash]['update_trackers'] = True
-        else:
-          self.status.update({infohash:{'data' : torrent}})
-          self.status.update({infohash:{'update_trackers' : True}})
+        if record is None:
+          record = self.set_status(torrent)
+        record.update_trackers = True
         
         # setting additional callback
         if set_functor != None and trackers != None:
@@ -83,40 +171,60 @@ class TorrentState:
 
   def clean_all(self):
     try:
-      for each in self.status.keys():
+      for record in self.status.values():
         
         # unset to release tracker update
-        self.status[each]
-        self.get_status(each)['update_trackers']  = False
+        record.update_trackers = False
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
-  def print(self, torrent):
+  def sweep(self, torrents):
+    '''
+      Marks given torrents as seen in a new cycle and evicts the
+      ones not seen for evict_cycles
+    '''
     try:
-      
-      name       = torrent["name"]
-      progress   = torrent["progress"]
-      downloaded = torrent["downloaded"]
-      size       = torrent["size"]
-      state      = torrent["state"]
-      num_leechs = torrent["num_leechs"]
-      num_seeds  = torrent["num_seeds"]
-      dlspeed    = torrent["dlspeed"]
-
-      # state derivative variables
-      missing = utilities.human_readable_data(size - downloaded)
-      hDwldSpeed = utilities.human_readable_data(dlspeed)
-      is_downloading = "   " if dlspeed == 0 else " * "
-      progress_str = "%3.2f%%"%(progress*100)
-      
-      # send state to the logs
-      self.logger.info("%18s|%s|%7s|%9s/s|%9s| %3d/%3d | %s"%
-                        (state, is_downloading, progress_str, hDwldSpeed, 
-                        str(missing), num_seeds, num_leechs, name))
-      
+      self.cycle += 1
+      for torrent in torrents:
+        record = self.status.get(torrent["hash"])
+        if record is not None:
+          record.last_seen = self.cycle
+
+      oldest = self.cycle - self.evict_cycles
+      evicted = [infohash for infohash, record in self.status.items()
+                 if record.last_seen < oldest]
+      for infohash in evicted:
+        del self.status[infohash]
+        self.dirty.add(infohash)
+
+      if len(evicted) > 0:
+        self.logger.debug("    Evicted %d torrents, keeping %d (%s)"%
+                          (len(evicted), len(self.status),
+                           utilities.human_readable_data(self.memory_usage()['bytes'])))
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
+  def memory_usage(self):
+    '''
+      Approximate size of kept state, tracker URLs are shared
+      and counted once
+    '''
+    size = sys.getsizeof(self.status)
+    urls = {}
+    for infohash, record in self.status.items():
+      size += sys.getsizeof(infohash) + sys.getsizeof(record) + \
+              sys.getsizeof(record.name)
+      if record.trackers is not None:
+        size += sys.getsizeof(record.trackers)
+        for url in record.trackers:
+          urls[id(url)] = url
+    size += sum([sys.getsizeof(url) for url in urls.values()])
+    return {'torrents': len(self.status), 'bytes': size}
+
+# selected trackers as handed to torrents, swapped as a whole so a
+# monitor never pairs a new hash with an old list
+TrackerList = namedtuple('TrackerList', ['trackers', 'data', 'hash'])
+
 class Trackers:
   def __init__(self, **kwargs):
     try:
@@ -124,7 +232,12 @@ class Trackers:
       self.logger   = utilities.GetLogger(class_name)
       self.update_trackers = 0
       self.last_update = 0
-      self.data     = None
+      self.current  = TrackerList([], None, None)
+      self.candidates = []
+      self.health   = None
+      self.etag     = None
+      self.last_modified = None
+      self.cache_path    = None
       
       # would always be the same?
       self.URL = "https://raw.githubusercontent.com/ngosang/trackerslist/master/trackers_all.txt"
@@ -132,6 +245,14 @@ class Trackers:
       for key in kwargs.keys():
         if key == "update_trackers":
           self.update_trackers = kwargs[key]
+        elif key == "trackers_cache":
+          self.cache_path = kwargs[key]
+        elif key == "tracker_top" and kwargs[key]:
+          self.health = TrackerHealth(**kwargs)
+
+      # start from latest known list
+      if self.cache_path:
+        self.load()
           
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
@@ -149,45 +270,298 @@ class Trackers:
       utilities.ParseException(inst, logger=self.logger)
     finally:
       return update_now
+
+  def parse(self, content):
+    '''
+      Returns trackers in given order without blanks nor duplicates
+    '''
+    if isinstance(content, bytes):
+      content = content.decode('utf-8', 'ignore')
+
+    trackers = []
+    seen = set()
+    for line in content.splitlines():
+      url = line.strip()
+      if url and not url.startswith('#') and url not in seen:
+        seen.add(url)
+        trackers.append(url)
+    return trackers
+
+  def set_trackers(self, trackers):
+    self.candidates = trackers
+    self.select(trackers)
+
+  def select(self, trackers):
+    '''
+      Sets trackers handed to torrents, only best ones of
+      downloaded list if their health is known
+    '''
+    if self.health is not None:
+      trackers = self.health.best(trackers)
+    data = "\n".join(trackers)
+    self.current = TrackerList(trackers, data, hashlib.sha1(data.encode('utf-8')).hexdigest())
+
+  @property
+  def trackers(self):
+    return self.current.trackers
+
+  @property
+  def data(self):
+    return self.current.data
+
+  @property
+  def hash(self):
+    return self.current.hash
+
+  def probe_due(self):
+    return self.health is not None and \
+           len(self.candidates) > 0 and \
+           self.health.due()
+
+  def probe(self):
+    '''
+      Probes downloaded trackers, returns True if best ones changed
+    '''
+    changed = False
+    try:
+      asyncio.run(self.health.probe(self.candidates))
+      if len(self.health.best(self.candidates)) < 1:
+        # more likely our own network is down
+        self.logger.warning("No healthy tracker found, keeping current ones")
+        return
+
+      previous_hash = self.hash
+      self.select(self.candidates)
+      changed = self.hash != previous_hash
+      self.logger.debug("    Selected %d of %d trackers (%s)"%
+                        (len(self.trackers), len(self.candidates), self.hash))
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return changed
+
+  def load(self):
+    try:
+      if not os.path.isfile(self.cache_path):
+        self.logger.debug("    No cached trackers in %s"%self.cache_path)
+        return
+
+      with open(self.cache_path, 'r') as cache_file:
+        self.set_trackers(self.parse(cache_file.read()))
+
+      meta_path = self.cache_path + '.json'
+      if os.path.isfile(meta_path):
+        with open(meta_path, 'r') as meta_file:
+          meta = json.load(meta_file)
+        self.etag          = meta.get('etag')
+        self.last_modified = meta.get('last_modified')
+        self.last_update   = meta.get('last_update', 0)
+
+      self.logger.info("Loaded %d cached trackers (%s)"%
+                       (len(self.trackers), self.hash))
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def save(self):
+    try:
+      # write aside and swap, a crash never leaves a partial list
+      temp_path = self.cache_path + '.tmp'
+      with open(temp_path, 'w') as cache_file:
+        cache_file.write("\n".join(self.candidates))
+      os.replace(temp_path, self.cache_path)
+
+      meta = {
+        'etag':          self.etag,
+        'last_modified': self.last_modified,
+        'last_update':   self.last_update,
+        'hash':          self.hash
+      }
+      with open(temp_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+      os.replace(temp_path, self.cache_path + '.json')
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
     
   def download(self, first_time = False):
+    '''
+      Returns True if tracker list has changed
+    '''
+    changed = False
     try:
       
       self.logger.debug("    Downloading trackers")
-      response = requests.get(self.URL)
-      if response.status_code > 299:
+      headers = {}
+      if self.data is not None:
+        if self.etag:
+          headers['If-None-Match'] = self.etag
+        if self.last_modified:
+          headers['If-Modified-Since'] = self.last_modified
+
+      import requests
+      response = requests.get(self.URL, headers=headers, timeout=30)
+      if response.status_code == 304:
+        self.logger.debug("    Trackers have not been modified")
+        self.last_update = time.time()
+        return
+      elif response.status_code > 299:
         self.logger.warning("Failed to contact trackers")
         return
 
-      # collect trackers info as-it-is
-      self.data = response.content
-      self.last_update = time.time()
-      
-      # quick count of trackers
-      occurrences = str(self.data).count("\\n")
-      self.logger.debug("    Found %s trackers"%str(occurrences))
+      # keep a parsed and unique list of trackers
+      trackers = self.parse(response.content)
+      previous_hash = self.hash
+      self.set_trackers(trackers)
+      self.etag          = response.headers.get('ETag')
+      self.last_modified = response.headers.get('Last-Modified')
+      self.last_update   = time.time()
+      changed = self.hash != previous_hash
+      self.logger.debug("    Found %d trackers (%s)"%(len(trackers), self.hash))
+
+      if self.cache_path:
+        self.save()
       
-      # mark trackers to be loaded
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return changed
 
   def get(self):
     return self.data
 
+  def snapshot(self):
+    return self.current
+
+class ActionBatch:
+  """
+  Collects torrent actions along a cycle to send them as grouped
+  multi-hash calls at the end of it
+  """
+  def __init__(self, **kwargs):
+    class_name      = self.__class__.__name__
+    self.logger     = utilities.GetLogger(class_name)
+    self.batch_size = 100
+    self.pending    = {'pause': {}, 'resume': {}, 'recheck': {}}
+    self.trackers   = {}
+    self.marks      = {}
+    self.sending    = {}
+    self.sent       = []
+    self.issued     = {}
+    try:
+      for key in kwargs.keys():
+        if key == "batch_size" and kwargs[key]:
+          self.batch_size = max(1, int(kwargs[key]))
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def add(self, action, infohash, name = None):
+    # latest of pause/resume wins within a cycle
+    if action == 'pause':
+      self.pending['resume'].pop(infohash, None)
+    elif action == 'resume':
+      self.pending['pause'].pop(infohash, None)
+    self.pending[action][infohash] = name
+
+  def add_trackers(self, infohash, trackers, mark = None):
+    '''
+      Mark is handed back by delivered() once trackers are sent
+    '''
+    self.trackers[infohash] = trackers
+    self.marks[infohash]    = mark
+
+  def size(self):
+    return sum([len(hashes) for hashes in self.pending.values()]) + \
+           len(self.trackers)
+
+  def chunks(self, hashes):
+    for i in range(0, len(hashes), self.batch_size):
+      yield hashes[i:i + self.batch_size]
+
+  def drain(self):
+    '''
+      Returns collected calls as (method, arguments) and clears them
+    '''
+    calls = []
+    methods = [('pause',   'pause_multiple'),
+               ('resume',  'resume_multiple'),
+               ('recheck', 'recheck')]
+    for action, method in methods:
+      hashes = list(self.pending[action].keys())
+      self.pending[action] = {}
+      for chunk in self.chunks(hashes):
+        calls.append((method, (chunk,)))
+      self.issued[action] = self.issued.get(action, 0) + len(hashes)
+
+    # addTrackers takes a single hash, so pushes are capped per
+    # cycle and the remaining ones are sent on following cycles
+    for infohash in list(self.trackers.keys())[:self.batch_size]:
+      calls.append(('add_trackers', (infohash, self.trackers.pop(infohash))))
+      self.sending[infohash] = self.marks.pop(infohash, None)
+      self.issued['add_trackers'] = self.issued.get('add_trackers', 0) + 1
+
+    if len(self.trackers) > 0:
+      self.logger.debug("    Deferred trackers for %d torrents"%len(self.trackers))
+    return calls
+
+  def succeeded(self, method, args):
+    if method == 'add_trackers':
+      self.sent.append(self.sending.pop(args[0], None))
+
+  def delivered(self):
+    '''
+      Marks of tracker pushes sent since last call, failed pushes
+      are forgotten and computed again
+    '''
+    sent = [mark for mark in self.sent if mark is not None]
+    self.sent    = []
+    self.sending = {}
+    return sent
+
+  def flush(self, qb):
+    requests_sent = 0
+    try:
+      for method, args in self.drain():
+        try:
+          getattr(qb, method)(*args)
+          self.succeeded(method, args)
+          requests_sent += 1
+        except Exception as inst:
+          self.logger.warning("Failed to send %s"%method)
+          utilities.ParseException(inst, logger=self.logger)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return requests_sent
+
 class QBitorrent:
   def __init__(self, **kwargs):
     class_name    = self.__class__.__name__
     self.logger   = utilities.GetLogger(class_name)
     self.qb       = None
+    self.api      = None
     self.access   = None
     self.user     = None
     self.host     = None
     self.port     = None
     self.timeout_secs  = 3600*24 * 365
     self.pause_expired = False
+    self.sync_mode     = False
+    self.rid           = 0
+    self.torrents      = {}
+    self.actions       = ActionBatch(**kwargs)
+    self.policies      = PolicyEngine(**kwargs) if policies.HAS_NUMPY else None
+    self.metrics       = None
+    self.api_timeout   = 30
+    self.breaker       = CircuitBreaker(**kwargs)
+    self.recorder      = None
+    self.index         = None
+    self.rechecked     = {}
     
-    try:
-      for key in kwargs.keys():
+    for key in kwargs.keys():
+      # a bad option is reported, following ones are still read
+      try:
         if key == "user":
           self.user = kwargs[key]
         elif key == "access":
@@ -196,82 +570,155 @@ class QBitorrent:
           self.host = kwargs[key]
         elif key == "port":
           self.port = kwargs[key]
-        elif key == "timeout_days":
+        elif key == "timeout_days" and kwargs[key] is not None:
           self.timeout_secs = 3600*24 * kwargs[key]
         elif key == "pause_expired":
           self.pause_expired = bool(kwargs[key])
+        elif key == "sync_mode":
+          self.sync_mode = bool(kwargs[key])
+        elif key == "api_timeout" and kwargs[key]:
+          self.api_timeout = kwargs[key]
+        elif key == "record" and kwargs[key]:
+          self.recorder = Recorder(kwargs[key], "%s:%s"%(self.host, self.port))
+        elif key == "recheck_present" and kwargs[key]:
+          self.index = DirectoryIndex(**kwargs)
     
-    except Exception as inst:
-      utilities.ParseException(inst, logger=self.logger)
+      except Exception as inst:
+        utilities.ParseException(inst, logger=self.logger)
 
   def is_connected(self):
     return self.qb and \
-           self.qb.verify and \
-           self.qb._is_authenticated
+           self.api.verify and \
+           self.api._is_authenticated
+
+  def set_api(self, api):
+    '''
+      Calls to the API go through the circuit breaker and are timed
+    '''
+    self.api = api
+    if self.recorder:
+      api = RecordingClient(api, self.recorder)
+    self.qb  = SessionClient(api, self.breaker, self.login)
+    if self.metrics:
+      self.qb = metrics.InstrumentedClient(self.qb, self.metrics)
+
+  def circuit_open(self):
+    if self.breaker.allow():
+      return False
+    self.logger.warning("Not connecting, circuit is open for %.0fs"%
+                        self.breaker.retry_after())
+    return True
+
+  def login(self):
+    '''
+      Logs in within current HTTP session, its connections and
+      cookies are kept
+    '''
+    self.logger.debug("Accessing to %s..."%self.api.url)
+    if not hasattr(self.api, 'session'):
+      import requests
+      self.api.session = requests.Session()
+    response = self.api.session.post(self.api.url + 'auth/login',
+                                     data={'username': self.user,
+                                           'password': self.access},
+                                     verify=self.api.verify,
+                                     timeout=self.api.timeout)
+    self.api._is_authenticated = response.text == 'Ok.'
+    return self.api._is_authenticated
 
   def connect(self):
     sucess = True
     try:
-      url = "http://%s:%s/"%(self.host, self.port)
-      self.logger.debug("Connecting to %s"%url)
-      self.qb = Client(url)
-      self.logger.debug("Accessing to %s..."%url)
-      self.qb.login(self.user, self.access)
+      if self.circuit_open():
+        sucess = False
+        return
 
-      if not self.qb or not self.qb.verify or not self.qb._is_authenticated:
-        self.qb = None
+      # client is only built once, restarts of qBittorrent
+      # just need a new login
+      if self.api is None:
+        url = "http://%s:%s/"%(self.host, self.port)
+        self.logger.debug("Connecting to %s"%url)
+        # HTTP client stack is the slowest import after NumPy
+        from qbittorrent import Client
+        self.set_api(Client(url, timeout=self.api_timeout))
+
+      if not self.api._is_authenticated and not self.login():
         raise Exception("QBitorrent connnection failed")
       
+      # a new session starts from a full torrent table
+      self.rid = 0
+
       # go on if things went well!
-      api_version = self.qb.api_version
-      qbittorrent_version = self.qb.qbittorrent_version
+      api_version = self.api.api_version
+      qbittorrent_version = self.api.qbittorrent_version
+      self.breaker.success()
       self.logger.info("Session established (%s, %s)."
         %(api_version, qbittorrent_version))
 
     except Exception as inst:
+      self.breaker.failure()
       utilities.ParseException(inst, logger=self.logger)
       sucess = False
     finally:
       return sucess
 
   def find_file(self, torrent):
+    '''
+      Rechecks a stopped incomplete torrent once its content is
+      found in the download directory with the expected size
+    '''
     try:
       progress = torrent['progress']
-      if progress < 1:
+      state = torrent['state']
+      if progress < 1 and state.startswith(RECHECK_STATES):
         name = torrent['name']
-        self.logger.debug("    Looking for [%s]"%name)
-        if 'download_path' in torrent and os.path.exists(torrent['download_path']):
-          
-          # get to know if file is already downloaded
-          file_path =  torrent['download_path'] + '/' + name
-          
-          # sometimes is a file or a path with more files
-          if os.path.isfile(file_path) or os.path.exists(file_path):
-            state = torrent['state']
-            infohash = torrent["hash"]
-            progress = torrent['progress']
-            
-            # here we might be double checking if torrent is paused
-            if state.startswith("paused") and progress < 1:
-              suffix = "%3.2f%%"%(progress*100)+ ' left'
-              self.logger.debug("      [%s] torrent file found %s %s"%
-                               (state, name, suffix))
-          
-            # there is already a torrent with the same name, let's try check it
-            # not working: disappears torrent: 
-            self.qb.recheck([infohash])
-            self.logger.info("  = = = [%s] Rechecked torrent [%s]"%(state, name))
-          
+        infohash = torrent["hash"]
+        for key in ('download_path', 'save_path'):
+          path = torrent.get(key)
+          if not path or not self.index.present(path, name, torrent.get('size')):
+            continue
+
+          # same content is rechecked only once
+          found = self.index.root(path)['entries'][name]
+          if self.rechecked.get(infohash) == found:
+            return
+          self.rechecked[infohash] = found
+
+          suffix = "%3.2f%%"%(progress*100)+ ' left'
+          self.logger.debug("      [%s] torrent file found %s %s"%
+                           (state, name, suffix))
+          self.actions.add('recheck', infohash, name)
+          self.logger.info("  = = = [%s] Rechecking torrent [%s]"%(state, name))
+          return
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def recheck_present(self, torrents):
+    '''
+      Looks up content of every given torrent in directory index
+    '''
+    try:
+      if self.index is None:
+        return
+      self.index.events()
+      for torrent in torrents:
+        self.find_file(torrent)
+
+      # forget torrents gone or rechecked into completion
+      current = set([torrent["hash"] for torrent in torrents if torrent["progress"] < 1])
+      for infohash in [infohash for infohash in self.rechecked if infohash not in current]:
+        del self.rechecked[infohash]
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
   def pause_torrent(self, infohash):
     try:
-      self.qb.pause(infohash)
+      self.actions.add('pause', infohash)
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
-  def set_trackers(self, torrent, trackers):
+  def set_trackers(self, torrent, trackers, mark = None):
     try:
       infohash = torrent["hash"]
       name = torrent["name"]
@@ -279,7 +726,7 @@ class QBitorrent:
         self.logger.warning("    Failed to set trackers into %s"%name)
         return False
 
-      self.qb.add_trackers(infohash, trackers)
+      self.actions.add_trackers(infohash, trackers, mark)
       self.logger.debug("    Set trackers into %s"%name)
       return True
     except Exception as inst:
@@ -288,10 +735,39 @@ class QBitorrent:
   def resurme_torrent(self, name, infohash):
     try:
       self.logger.debug("    Resuming torrent %s"%name)
-      self.qb.resume(infohash)
+      self.actions.add('resume', infohash, name)
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
+  def flush(self):
+    '''
+      Sends actions collected along current cycle
+    '''
+    requests_sent = 0
+    try:
+      if self.actions.size() > 0:
+        requests_sent = self.actions.flush(self.qb)
+        self.logger.debug("  Sent actions in %d requests"%requests_sent)
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return requests_sent
+
+  def get_trackers(self, infohash):
+    '''
+      Returns tracker URLs of a torrent, without DHT, PeX and LSD entries
+    '''
+    trackers = None
+    try:
+      response = self.qb.get_torrent_trackers(infohash)
+      trackers = [tracker['url'] for tracker in response
+                  if not tracker['url'].startswith('** [')]
+    except Exception as inst:
+      self.logger.warning("Failed to collect trackers of %s"%infohash)
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return trackers
+
   def get_torrents(self):
     torrents = None
     try:
@@ -302,6 +778,80 @@ class QBitorrent:
     finally:
       return torrents
 
+  def update_all(self, torrents):
+    '''
+      Applies policies to a cycle snapshot, returns infohashes per action
+    '''
+    actions = {}
+    try:
+      # without NumPy every torrent goes through update()
+      if self.policies is None:
+        for torrent in torrents:
+          self.update(torrent)
+        return
+
+      now = time.time()
+      matches = self.policies.evaluate(torrents)
+      for action, rules in matches.items():
+        hashes = actions.setdefault(action, set())
+        for rule, indexes in rules.items():
+          for index in indexes:
+            torrent = torrents[index]
+            name = torrent["name"]
+            if rule == 'finished':
+              self.logger.info("  = = = Pausing finished [%s]"%(name))
+            elif rule == 'expired':
+              elapsed_datetime = str(timedelta(seconds=now - torrent["last_activity"]))
+              self.logger.info("  = = = Turning off torrent [%s] off since %s"%
+                               (name, elapsed_datetime))
+            else:
+              self.logger.info("  = = = Pausing [%s] over %s limit"%(name, rule))
+            hashes.add(torrent["hash"])
+
+      for infohash in actions.get('pause', []):
+        self.pause_torrent(infohash)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return actions
+
+  def merge_torrents(self, data):
+    '''
+      Merges sync/maindata response into local torrent table,
+      returns list of torrents that changed since last response
+    '''
+    if data.get('full_update'):
+      self.torrents = {}
+
+    changed = []
+    for infohash, delta in data.get('torrents', {}).items():
+      # deltas do not carry the hash, only changed fields
+      torrent = self.torrents.setdefault(infohash, {'hash': infohash})
+      torrent.update(delta)
+      changed.append(torrent)
+
+    for infohash in data.get('torrents_removed', []):
+      self.torrents.pop(infohash, None)
+
+    self.rid = data.get('rid', self.rid)
+    return changed
+
+  def sync_torrents(self):
+    changed = None
+    try:
+      data = self.qb.sync_main_data(rid=self.rid)
+      changed = self.merge_torrents(data)
+      self.logger.debug("    Synchronised %d/%d torrents (rid=%s)"%
+                        (len(changed), len(self.torrents), str(self.rid)))
+    except Exception as inst:
+      # ask for a full update next time
+      self.rid = 0
+      self.logger.warning("Failed to synchronise torrents")
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return changed
+
   def update(self, torrent):
     try:
       
@@ -334,7 +884,142 @@ class QBitorrent:
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
-class QBitorrentRunner(Runner):
+class AsyncQBitorrent(QBitorrent):
+  """
+  Same policies as QBitorrent, API calls are awaited through an
+  aiohttp session with bounded in-flight requests
+  """
+  def __init__(self, **kwargs):
+    QBitorrent.__init__(self, **kwargs)
+    self.max_inflight = 8
+    try:
+      for key in kwargs.keys():
+        if key == "max_inflight" and kwargs[key]:
+          self.max_inflight = max(1, int(kwargs[key]))
+      self.semaphore = asyncio.Semaphore(self.max_inflight)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  async def call(self, method, *args):
+    async with self.semaphore:
+      return await getattr(self.qb, method)(*args)
+
+  async def close(self):
+    try:
+      if self.recorder:
+        self.recorder.close()
+      if self.index:
+        self.index.close()
+      if self.api:
+        await self.api.close()
+        self.api = None
+        self.qb  = None
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  async def login(self):
+    self.logger.debug("Accessing to %s..."%self.api.url)
+    await self.api.login(self.user, self.access)
+    return self.api._is_authenticated
+
+  async def connect(self):
+    sucess = True
+    try:
+      # aiohttp is only needed by async mode
+      from aioclient import AsyncClient
+
+      if self.circuit_open():
+        sucess = False
+        return
+
+      # keep-alive session and its cookies outlive logins
+      if self.api is None:
+        url = "http://%s:%s/"%(self.host, self.port)
+        self.logger.debug("Connecting to %s"%url)
+        self.set_api(AsyncClient(url, timeout=self.api_timeout, limit=self.max_inflight))
+
+      if not await self.login():
+        raise Exception("QBitorrent connnection failed")
+      
+      # a new session starts from a full torrent table
+      self.rid = 0
+
+      api_version = await self.api.api_version()
+      qbittorrent_version = await self.api.qbittorrent_version()
+      self.breaker.success()
+      self.logger.info("Session established (%s, %s)."
+        %(api_version, qbittorrent_version))
+
+    except Exception as inst:
+      self.breaker.failure()
+      utilities.ParseException(inst, logger=self.logger)
+      sucess = False
+    finally:
+      return sucess
+
+  async def get_trackers(self, infohash):
+    trackers = None
+    try:
+      response = await self.call('get_torrent_trackers', infohash)
+      trackers = [tracker['url'] for tracker in response
+                  if not tracker['url'].startswith('** [')]
+    except Exception as inst:
+      self.logger.warning("Failed to collect trackers of %s"%infohash)
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return trackers
+
+  async def get_torrents(self):
+    torrents = None
+    try:
+      torrents = await self.call('torrents')
+    except Exception as inst:
+      self.logger.warning("Failed to collect torrents")
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return torrents
+
+  async def sync_torrents(self):
+    changed = None
+    try:
+      data = await self.call('sync_main_data', self.rid)
+      changed = self.merge_torrents(data)
+      self.logger.debug("    Synchronised %d/%d torrents (rid=%s)"%
+                        (len(changed), len(self.torrents), str(self.rid)))
+    except Exception as inst:
+      # ask for a full update next time
+      self.rid = 0
+      self.logger.warning("Failed to synchronise torrents")
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return changed
+
+  async def flush(self):
+    requests_sent = 0
+    try:
+      calls = self.actions.drain()
+      results = await asyncio.gather(
+        *[self.call(method, *args) for method, args in calls],
+        return_exceptions=True)
+      for (method, args), result in zip(calls, results):
+        if isinstance(result, Exception):
+          self.logger.warning("Failed to send %s"%method)
+        else:
+          self.actions.succeeded(method, args)
+          requests_sent += 1
+      if len(calls) > 0:
+        self.logger.debug("  Sent actions in %d requests"%requests_sent)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return requests_sent
+
+class QBitorrentMonitor:
+  """
+  Monitoring cycle of a qBittorrent client, independent of the runner
+  """
   def __init__(self, **kwargs):
     class_name  = self.__class__.__name__
     self.logger = utilities.GetLogger(class_name)
@@ -342,16 +1027,59 @@ class QBitorrentRunner(Runner):
 
     try:
       self.logger.info("Creating QBitorrent object")
-      self.client   = QBitorrent(**kwargs)
+      # only the client in use is built, each holds its own index,
+      # policies and recorder
+      if kwargs.get('async_mode') or kwargs.get('hosts'):
+        self.client = AsyncQBitorrent(**kwargs)
+      else:
+        self.client = QBitorrent(**kwargs)
       self.trackers = Trackers(**kwargs)
       self.state    = TorrentState(**kwargs)
-  
-      self.set_runner(kwargs, self.update)
-      Runner.__init__(self, **kwargs)
+      self.renderer = StatusRenderer(**kwargs)
+      self.optimizer = SlotOptimizer(**kwargs)
+      self.history  = None
+      if timeseries.HAS_NUMPY and kwargs.get('history_torrents') != 0:
+        self.history = TimeSeries(**kwargs)
+        self.renderer.eta = self.history.eta
+      self.trackers_lock = asyncio.Lock()
+      self.trackers_seen = None
+      self.trackers_hash = None
+      self.tracker_list  = self.trackers.snapshot()
+      self.sum_dlspeed   = 0
+      self.activity      = {}
+      # sync mode runs policies over every torrent this often
+      self.full_scan     = 900 if kwargs.get('full_scan') is None else kwargs['full_scan']
+      self.last_scan     = 0
+      self.last_measure  = 0
+
+      # instrumentation is cheap enough to be always on
+      self.metrics_port  = kwargs.get('metrics_port')
+      self.cycle_summary = bool(kwargs.get('cycle_summary'))
+      self.metrics = metrics.Metrics("%s:%s"%(kwargs.get('host'), kwargs.get('port')))
+      self.client.metrics = self.metrics
+      metrics.register(self.metrics)
+
+      # resume from last saved state
+      self.store = None
+      if kwargs.get('state_db'):
+        self.store = StateStore(**kwargs)
+        self.store.load(self.state, self.trackers)
 
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
+  def schedule_hint(self):
+    '''
+      Activity of last cycle and circuit state, lets the runner
+      adapt its polling
+    '''
+    hint = dict(self.activity)
+    hint['circuit'] = self.client.breaker.state
+    retry_after = self.client.breaker.retry_after()
+    if retry_after > 0:
+      hint['retry_after'] = retry_after
+    return hint
+
   def set_runner(self, kwargs, funct):
     '''
       Set function for runner
@@ -359,6 +1087,7 @@ class QBitorrentRunner(Runner):
     try:
       self.logger.info("Setting runner function")
       # Initialising runner function
+      kwargs.update({"hint_func" : self.schedule_hint})
       if "app_func" not in kwargs:
         kwargs.update({"app_func" : funct})
       else:
@@ -392,82 +1121,509 @@ class QBitorrentRunner(Runner):
     finally:
       return is_connected
 
+  async def async_connected(self):
+    is_connected = True
+    try:
+      self.logger.debug("Connecting QBitorrent client ...")
+      if not self.client.is_connected():
+        if await self.client.connect():
+          self.logger.debug(" Qbittorrent connected!")
+        else:
+          is_connected = False
+          self.logger.warning(" Failed to connect client")
+      else:
+        self.logger.debug(" Qbittorrent client is already connected")
+
+    except Exception as inst:
+      is_connected = False
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return is_connected
+
+  def tracker_due(self, torrent):
+    '''
+      Returns True if torrent trackers should be reconciled
+    '''
+    record = self.state.get_status(torrent["hash"])
+    if record is None or record.last_update_trackers is None:
+      return True
+    elapsed = datetime.timestamp(datetime.now()) - record.last_update_trackers
+    return elapsed >= self.state.trackers_timeout
+
+  def trackers_current(self, torrent):
+    '''
+      Torrent already got latest list and nothing changed its trackers
+    '''
+    record = self.state.get_status(torrent["hash"])
+    return record is not None and \
+           record.trackers_hash == self.tracker_list.hash and \
+           not self.state.trackers_stale(torrent)
+
+  def due_torrent_trackers(self, torrents):
+    '''
+      Returns torrents due for reconciliation whose cached
+      trackers are unknown or outdated
+    '''
+    if self.tracker_list.hash is None:
+      return []
+    return [torrent for torrent in torrents
+            if self.tracker_due(torrent) and \
+               self.state.trackers_stale(torrent)]
+
+  def refresh_torrent_trackers(self, torrents):
+    '''
+      Lazily fetches trackers of torrents due for reconciliation
+    '''
+    try:
+      for torrent in self.due_torrent_trackers(torrents):
+        current = self.client.get_trackers(torrent["hash"])
+        if current is not None:
+          self.state.set_trackers(torrent, current)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  async def async_refresh_torrent_trackers(self, torrents):
+    try:
+      due = self.due_torrent_trackers(torrents)
+      results = await asyncio.gather(
+        *[self.client.get_trackers(torrent["hash"]) for torrent in due])
+      for torrent, current in zip(due, results):
+        if current is not None:
+          self.state.set_trackers(torrent, current)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
   def updated_torrent_trackers(self, torrent, trackers):
     try:
         # getting torrent identifier
         infohash = torrent["hash"]
-        state = self.state.status
-        if infohash in state:
-          if 'last_update_trackers' in state[infohash]:
-            last_update_trackers = state[infohash]['last_update_trackers']
-            is_time = datetime.timestamp(datetime.now()) - last_update_trackers
-            
-            if is_time >= self.state.trackers_timeout:
-              self.state.update_tracker_ts(torrent)
-              self.client.set_trackers(torrent, trackers)
-          else:
-            self.update_tracker(torrent)
-        else:
+        if not self.tracker_due(torrent):
+          return
+
+        if self.state.get_status(infohash) is None:
           self.state.set_status(torrent)
+
+        # up to date torrents are skipped entirely
+        if trackers is None or self.trackers_current(torrent):
           self.state.update_tracker_ts(torrent)
-          self.client.set_trackers(torrent, trackers)
+          return
+
+        # only send trackers that torrent does not have yet
+        current = self.state.get_trackers(infohash)
+        missing = [url for url in self.tracker_list.trackers
+                   if current is None or url not in current]
+        if len(missing) > 0:
+          # torrent is marked current once trackers are really sent,
+          # pushes deferred to later cycles are not lost on a restart
+          mark = ({'hash': infohash, 'name': torrent["name"]}, missing, self.tracker_list.hash)
+          if not self.client.set_trackers(torrent, "\n".join(missing), mark):
+            self.state.update_tracker_ts(torrent)
+          else:
+            self.logger.debug("    Sending %d/%d trackers to %s"%
+                              (len(missing), len(self.tracker_list.trackers), torrent["name"]))
+          return
+        self.state.update_tracker_ts(torrent, self.tracker_list.hash)
           
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
+  def trackers_delivered(self):
+    '''
+      Torrents whose tracker pushes got through are up to date
+    '''
+    for torrent, missing, trackers_hash in self.client.actions.delivered():
+      self.state.add_trackers(torrent["hash"], missing)
+      self.state.update_tracker_ts(torrent, trackers_hash)
+
+  def trackers_refreshed(self):
+    '''
+      True once after each tracker list download or selection,
+      torrent flags are released whenever list content has changed
+    '''
+    seen = (self.trackers.last_update, self.tracker_list.hash)
+    if seen == self.trackers_seen:
+      return False
+
+    self.trackers_seen = seen
+    if self.tracker_list.hash != self.trackers_hash:
+      self.trackers_hash = self.tracker_list.hash
+      self.state.clean_all()
+    return True
+
+  def select_torrents(self, torrents, refresh_trackers):
+    '''
+      Returns torrents to go through policies and all known torrents,
+      or None if they could not be collected
+    '''
+    if self.client.sync_mode:
+      if torrents is None:
+        return None
+      all_torrents = list(self.client.torrents.values())
+
+      # idle torrents may not change for days, whole table goes
+      # through the policies whenever trackers are refreshed and
+      # every full_scan seconds, so expiry and stall rules reach them
+      now = time.time()
+      scan_due = self.full_scan > 0 and now - self.last_scan >= self.full_scan
+      if refresh_trackers or scan_due:
+        self.logger.debug("  Running policies over all %d torrents"%len(all_torrents))
+        torrents = all_torrents
+        self.last_scan = now
+      return torrents, all_torrents
+
+    if not torrents:
+      return None
+    return torrents, torrents
+
+  def process(self, torrents, all_torrents, trackers):
+    try:
+      # print changes of torrent state
+      with self.metrics.phase('print'):
+        self.renderer.render(torrents, all_torrents)
+        
+      # mark trackers to general status
+      # self.state.set(torrent, trackers, self.client.set_trackers)
+      with self.metrics.phase('trackers_push'):
+        for torrent in torrents:
+          self.updated_torrent_trackers(torrent, trackers)
+
+      # update state based on current status
+      with self.metrics.phase('policies'):
+        self.client.update_all(torrents)
+
+      # content already downloaded somewhere else
+      if self.client.index is not None:
+        with self.metrics.phase('recheck'):
+          self.client.recheck_present(all_torrents)
+
+      # keep download slots to the fastest torrents
+      with self.metrics.phase('optimizer'):
+        self.optimizer.run(self.state, self.client, all_torrents)
+
+      # accumulating download speed
+      sum_dlspeed = 0
+      active = 0
+      near_completion = 0
+      for torrent in all_torrents:
+        dlspeed = torrent["dlspeed"]
+        if dlspeed>0:
+          sum_dlspeed += dlspeed
+          if torrent["progress"] < 1:
+            active += 1
+            if torrent["progress"] >= NEAR_COMPLETION:
+              near_completion += 1
+        
+      self.sum_dlspeed = sum_dlspeed
+      self.activity = {'active': active, 'near_completion': near_completion}
+      if self.history is not None:
+        with self.metrics.phase('history'):
+          self.history.add(all_torrents, sum_dlspeed)
+          self.history_gauges()
+      self.logger.info("  = = = Accumulated download speed: %s"%
+                       utilities.human_readable_data(sum_dlspeed))
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def start_cycle(self):
+    if self.metrics_port:
+      metrics.serve(self.metrics_port)
+    self.metrics.start_cycle()
+    if self.client.recorder:
+      # calls of a failed cycle
+      self.client.recorder.end_cycle()
+
+  def history_gauges(self):
+    '''
+      Fleet download speed percentiles of last ten minutes and
+      size of the history as gauges
+    '''
+    speeds = self.history.throughput(10)
+    for percentile, speed in (speeds or {}).items():
+      self.metrics.set_gauge('download_speed_p%d'%percentile, int(speed))
+    usage = self.history.memory_usage()
+    self.metrics.set_gauge('history_torrents', usage['torrents'])
+    self.metrics.set_gauge('history_bytes', usage['bytes'])
+
+  def measure_state(self):
+    '''
+      Size of kept state as gauges, walking it costs so its memory
+      is only measured once a minute
+    '''
+    self.metrics.set_gauge('state_torrents', len(self.state.status))
+    now = time.time()
+    if now - self.last_measure >= 60:
+      self.metrics.set_gauge('state_bytes', self.state.memory_usage()['bytes'])
+      self.last_measure = now
+
+  def end_cycle(self, torrents):
+    if self.client.recorder:
+      self.client.recorder.end_cycle(self.tracker_list.data)
+    self.measure_state()
+    summary = self.metrics.end_cycle(len(torrents), self.client.actions.issued)
+    if self.cycle_summary:
+      self.logger.info("  = = = %s"%summary)
+
   def update(self):
     is_ok = True
-    sum_dlspeed = 0
     try:
+      self.start_cycle()
       
       # Connect to server first
-      if not self.connected():
-        is_ok = False
-        return
+      with self.metrics.phase('connect'):
+        if not self.connected():
+          is_ok = False
+          return
       
       # Collect trackers every now and then...
-      if self.trackers.wait():
-        self.trackers.download()
-        self.state.clean_all()
-      trackers = self.trackers.get()
+      with self.metrics.phase('trackers_download'):
+        if self.trackers.wait():
+          self.trackers.download()
+        if self.trackers.probe_due():
+          self.trackers.probe()
+        self.tracker_list = self.trackers.snapshot()
+        refresh_trackers = self.trackers_refreshed()
+        trackers = self.tracker_list.data
       
       # get into each torrent
       self.logger.info("Updating client state...")
-      torrents = self.client.get_torrents()
-      if not torrents:
+      with self.metrics.phase('torrents'):
+        if self.client.sync_mode:
+          torrents = self.client.sync_torrents()
+        else:
+          torrents = self.client.get_torrents()
+      selected = self.select_torrents(torrents, refresh_trackers)
+      if selected is None:
         is_ok = False
         return
+      torrents, all_torrents = selected
+      self.state.sweep(all_torrents)
       
-      # get torrents info
-      for torrent in torrents:
-        
-        # print current torrent state
-        self.state.print(torrent)
-        
-        # mark trackers to general status
-        # self.state.set(torrent, trackers, self.client.set_trackers)
-        self.updated_torrent_trackers(torrent, trackers)
-        
-        # update state based on current status
-        self.client.update(torrent)
-        
-        # accumulating download speed
-        dlspeed = torrent["dlspeed"]
-        if dlspeed>0: sum_dlspeed += dlspeed
-        
-      self.logger.info("  = = = Accumulated download speed: %s"%
-                       utilities.human_readable_data(sum_dlspeed))
+      # know current trackers of torrents due for an update
+      with self.metrics.phase('trackers_lookup'):
+        self.refresh_torrent_trackers(torrents)
+      self.process(torrents, all_torrents, trackers)
+      
+      # send actions collected along the cycle
+      with self.metrics.phase('flush'):
+        self.client.flush()
+        self.trackers_delivered()
+      if self.store:
+        with self.metrics.phase('store'):
+          self.store.save(self.state, self.trackers)
+      self.end_cycle(torrents)
         
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
     finally:
       return is_ok
+
+  async def async_update(self):
+    is_ok = True
+    try:
+      self.start_cycle()
+      
+      # Connect to server first
+      with self.metrics.phase('connect'):
+        if not await self.async_connected():
+          is_ok = False
+          return
+      
+      # tracker list is small, download does not need the event loop
+      # and list might be shared with other monitors
+      with self.metrics.phase('trackers_download'):
+        async with self.trackers_lock:
+          if self.trackers.wait():
+            await asyncio.to_thread(self.trackers.download)
+          if self.trackers.probe_due():
+            await asyncio.to_thread(self.trackers.probe)
+          # list is swapped by other hosts' downloads, this cycle
+          # keeps the one read here
+          self.tracker_list = self.trackers.snapshot()
+        refresh_trackers = self.trackers_refreshed()
+        trackers = self.tracker_list.data
+      
+      self.logger.info("Updating client state...")
+      with self.metrics.phase('torrents'):
+        if self.client.sync_mode:
+          torrents = await self.client.sync_torrents()
+        else:
+          torrents = await self.client.get_torrents()
+      selected = self.select_torrents(torrents, refresh_trackers)
+      if selected is None:
+        is_ok = False
+        return
+      torrents, all_torrents = selected
+      self.state.sweep(all_torrents)
       
+      # tracker lookups and actions are sent concurrently
+      with self.metrics.phase('trackers_lookup'):
+        await self.async_refresh_torrent_trackers(torrents)
+      self.process(torrents, all_torrents, trackers)
+      with self.metrics.phase('flush'):
+        await self.client.flush()
+        self.trackers_delivered()
+      if self.store:
+        with self.metrics.phase('store'):
+          self.store.save(self.state, self.trackers)
+      self.end_cycle(torrents)
+        
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return is_ok
+
+class QBitorrentRunner(QBitorrentMonitor, Runner):
+  def __init__(self, **kwargs):
+    QBitorrentMonitor.__init__(self, **kwargs)
+    try:
+      self.set_runner(kwargs, self.update)
+      Runner.__init__(self, **kwargs)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+class AsyncQBitorrentRunner(QBitorrentMonitor, AsyncRunner):
+  def __init__(self, **kwargs):
+    QBitorrentMonitor.__init__(self, **kwargs)
+    try:
+      self.set_runner(kwargs, self.async_update)
+      AsyncRunner.__init__(self, **kwargs)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  async def shutdown(self):
+    await self.client.close()
+
+class QBitorrentFleet(AsyncRunner):
+  """
+  Monitors several qBittorrent hosts in one event loop, every host
+  with its own session, state and schedule
+  """
+  def __init__(self, **kwargs):
+    class_name  = self.__class__.__name__
+    self.logger = utilities.GetLogger(class_name)
+    self.monitors = []
+
+    try:
+      self.monitors = fleet_monitors(kwargs)
+      self.logger.info("Monitoring %d hosts"%len(self.monitors))
+
+      kwargs["app_func"]  = [self.host_update(monitor) for monitor in self.monitors]
+      kwargs["hint_func"] = [monitor.schedule_hint for monitor in self.monitors]
+      AsyncRunner.__init__(self, **kwargs)
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def host_update(self, monitor):
+    async def update():
+      is_ok = await monitor.async_update()
+      sum_dlspeed = sum([each.sum_dlspeed for each in self.monitors])
+      self.logger.info("  = = = Accumulated download speed of %d hosts: %s"%
+                       (len(self.monitors), utilities.human_readable_data(sum_dlspeed)))
+      return is_ok
+    return update
+
+  async def shutdown(self):
+    for monitor in self.monitors:
+      await monitor.client.close()
+
+def parse_hosts(kwargs):
+  '''
+    Hosts are given as comma separated [user:access@]host:port
+  '''
+  endpoints = []
+  for entry in kwargs['hosts'].split(','):
+    entry = entry.strip()
+    if not entry:
+      continue
+
+    endpoint = {'user': kwargs.get('user'), 'access': kwargs.get('access')}
+    credentials, _, address = entry.rpartition('@')
+    if credentials:
+      user, _, access = credentials.partition(':')
+      endpoint.update({'user': user, 'access': access})
+    host, _, port = address.rpartition(':')
+    endpoint.update({'host': host, 'port': port})
+    endpoints.append(endpoint)
+  return endpoints
+
+def fleet_monitors(kwargs):
+  '''
+    One async monitor per host, all sharing a tracker list
+  '''
+  monitors = []
+  trackers      = None
+  trackers_lock = asyncio.Lock()
+
+  for endpoint in parse_hosts(kwargs):
+    options = dict(kwargs)
+    options.update(endpoint)
+    monitor = QBitorrentMonitor(**options)
+    monitor.logger = utilities.GetLogger("%s[%s:%s]"%
+      (monitor.__class__.__name__, endpoint['host'], endpoint['port']))
+    if trackers is None:
+      trackers = monitor.trackers
+    monitor.trackers = trackers
+    monitor.trackers_lock = trackers_lock
+    monitors.append(monitor)
+  return monitors
+
 ## Process management methods
+def run_once(options):
+  '''
+    Runs a single cycle in this process, for cron and one-shot
+    calls. Returns True if every host went fine.
+  '''
+  is_ok = False
+  try:
+    # a single cycle has no history to keep
+    options = dict(options)
+    if options.get('history_torrents') is None:
+      options['history_torrents'] = 0
+
+    if options.get('hosts'):
+      monitors = fleet_monitors(options)
+    else:
+      monitors = [QBitorrentMonitor(**options)]
+
+    if options.get('hosts') or options.get('async_mode'):
+      async def cycle():
+        try:
+          return await asyncio.gather(*[monitor.async_update() for monitor in monitors])
+        finally:
+          for monitor in monitors:
+            await monitor.client.close()
+      results = asyncio.run(cycle())
+    else:
+      results = [monitor.update() for monitor in monitors]
+      for monitor in monitors:
+        if monitor.client.recorder:
+          monitor.client.recorder.close()
+        if monitor.client.index:
+          monitor.client.index.close()
+    is_ok = all(results)
+
+  except Exception as inst:
+    utilities.ParseException(inst, logger=logger)
+  finally:
+    return is_ok
+
 def call_task(options):
   ''' Command line method for running sniffer service'''
   try:
-    monitor = QBitorrentRunner(**options)
+    if options.get('once'):
+      sys.exit(0 if run_once(options) else 1)
+    if options.get('hosts'):
+      monitor = QBitorrentFleet(**options)
+    elif options.get('async_mode'):
+      monitor = AsyncQBitorrentRunner(**options)
+    else:
+      monitor = QBitorrentRunner(**options)
   except Exception as inst:
       utilities.ParseException(inst, logger=logger)
 
@@ -500,6 +1656,11 @@ if __name__ == '__main__':
                 action='store',
                 default=os.environ.get('QBIT_PORT'),
                 help='Input qbitorrent port')
+  app_opts.add_option('--hosts',
+                type="string",
+                action='store',
+                default=os.environ.get('QBIT_HOSTS'),
+                help='Comma separated [user:access@]host:port list')
 
   run_time = OptionGroup(parser, "Runtime options")
   run_time.add_option('--update_trackers',
@@ -517,6 +1678,26 @@ if __name__ == '__main__':
                 action='store',
                 default=os.environ.get('QBIT_SLEEP'),
                 help='Input runner sleep time')
+  run_time.add_option('--adaptive',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_ADAPTIVE'),
+                help='Adapt polling period to torrent activity')
+  run_time.add_option('--min_time_out',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_MIN_TIMEOUT'),
+                help='Shortest adaptive polling period')
+  run_time.add_option('--max_time_out',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_MAX_TIMEOUT'),
+                help='Longest adaptive polling period')
+  run_time.add_option('--wakeup_socket',
+                type="string",
+                action='store',
+                default=os.environ.get('QBIT_WAKEUP_SOCKET'),
+                help='Local socket path forcing a cycle on any message')
   run_time.add_option('--pause_expired',
                 type="int",
                 action='store',
@@ -527,13 +1708,177 @@ if __name__ == '__main__':
                 action='store',
                 default=os.environ.get('QBIT_EXPIRE'),
                 help='Pause old torrents')
+  run_time.add_option('--max_ratio',
+                type="float",
+                action='store',
+                default=os.environ.get('QBIT_MAX_RATIO'),
+                help='Pause finished torrents over this share ratio')
+  run_time.add_option('--max_seeding_days',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_MAX_SEEDING'),
+                help='Pause finished torrents seeding for longer')
+  run_time.add_option('--sync_mode',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_SYNC'),
+                help='Poll only torrent changes since last cycle')
+  run_time.add_option('--full_scan',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_FULL_SCAN'),
+                help='Seconds between policy runs over all torrents in sync mode, 900 by default, 0 disables')
+  run_time.add_option('--batch_size',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_BATCH'),
+                help='Maximum torrents per grouped action request')
+  run_time.add_option('--trackers_cache',
+                type="string",
+                action='store',
+                default=os.environ.get('QBIT_TRCK_CACHE'),
+                help='File keeping a copy of downloaded trackers')
+  run_time.add_option('--async_mode',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_ASYNC'),
+                help='Run monitor in an asyncio event loop')
+  run_time.add_option('--once',
+                action='store_true',
+                default=bool(os.environ.get('QBIT_ONCE')),
+                help='Run a single cycle in this process and exit')
+  run_time.add_option('--max_inflight',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_INFLIGHT'),
+                help='Maximum concurrent API calls in async mode')
+  run_time.add_option('--api_timeout',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_API_TIMEOUT'),
+                help='Seconds to wait for an API call')
+  run_time.add_option('--breaker_failures',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_BREAKER_FAILURES'),
+                help='Consecutive host failures opening the circuit')
+  run_time.add_option('--backoff_max',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_BACKOFF_MAX'),
+                help='Longest wait before probing a failing host')
+  run_time.add_option('--record',
+                type="string",
+                action='store',
+                default=os.environ.get('QBIT_RECORD'),
+                help='Gzip file recording API responses and actions of every cycle')
+  run_time.add_option('--tracker_top',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_TRACKER_TOP'),
+                help='Push only this many healthiest trackers, all if unset')
+  run_time.add_option('--probe_interval',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_PROBE_INTERVAL'),
+                help='Seconds between tracker health probes')
+  run_time.add_option('--probe_timeout',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_PROBE_TIMEOUT'),
+                help='Seconds to wait for a tracker to answer')
+  run_time.add_option('--probe_parallel',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_PROBE_PARALLEL'),
+                help='Trackers probed at the same time')
+  run_time.add_option('--active_slots',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_ACTIVE_SLOTS'),
+                help='Downloads kept active, slowest ones are paused')
+  run_time.add_option('--slot_hold_cycles',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_SLOT_HOLD_CYCLES'),
+                help='Cycles a torrent keeps its slot state after a switch')
+  run_time.add_option('--slot_margin',
+                type="float",
+                action='store',
+                default=os.environ.get('QBIT_SLOT_MARGIN'),
+                help='Times faster a paused torrent must be expected to swap slots')
+  run_time.add_option('--slot_swaps',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_SLOT_SWAPS'),
+                help='Maximum slot swaps per cycle')
+  run_time.add_option('--history_torrents',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_HISTORY_TORRENTS'),
+                help='Incomplete torrents kept in speed history, 0 disables it')
+  run_time.add_option('--history_points',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_HISTORY_POINTS'),
+                help='History points per resolution')
+  run_time.add_option('--recheck_present',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_RECHECK_PRESENT'),
+                help='Recheck stopped torrents whose content is found on disk')
+  run_time.add_option('--index_refresh',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_INDEX_REFRESH'),
+                help='Seconds between full scans of download directories')
+  run_time.add_option('--evict_cycles',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_EVICT'),
+                help='Cycles before forgetting a removed torrent')
+  run_time.add_option('--state_db',
+                type="string",
+                action='store',
+                default=os.environ.get('QBIT_STATE_DB'),
+                help='SQLite file keeping monitor state across restarts')
+  run_time.add_option('--state_max_writes',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_STATE_WRITES'),
+                help='Maximum torrent records saved per cycle')
+  run_time.add_option('--metrics_port',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_METRICS_PORT'),
+                help='Port serving Prometheus metrics')
+  run_time.add_option('--cycle_summary',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_CYCLE_SUMMARY'),
+                help='Log timing summary of each cycle')
+  run_time.add_option('--full_table_every',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_FULL_TABLE'),
+                help='Cycles between full status tables, only changes otherwise')
+  run_time.add_option('--progress_step',
+                type="int",
+                action='store',
+                default=os.environ.get('QBIT_PROGRESS_STEP'),
+                help='Progress percent a torrent moves before being printed')
+  run_time.add_option('--status_json',
+                type="string",
+                action='store',
+                default=os.environ.get('QBIT_STATUS_JSON'),
+                help='File appended with changed torrents as JSON lines, - for stdout')
 
   parser.add_option_group(app_opts)
   parser.add_option_group(run_time)
   (options, args) = parser.parse_args()
   option_dict = vars(options)
 
-  if not options.host:
+  if not options.host and not options.hosts:
     parser.error("host name is required")
   # print(options)
   
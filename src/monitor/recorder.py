@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import logging
+import utilities
+
+from optparse import OptionParser
+
+READ_CALLS   = ('torrents', 'sync_main_data', 'get_torrent_trackers')
+ACTION_CALLS = ('pause_multiple', 'resume_multiple', 'recheck', 'add_trackers')
+
+# open recordings by path, hosts of a fleet write into one gzip
+# stream as two appending ones would corrupt the file
+STREAMS = {}
+
+class ReplayFinished(Exception):
+  def __str__(self):
+    return 'No more recorded cycles.'
+
+class Recorder:
+  '''
+    Appends every cycle as one JSON line to a gzip file: API
+    responses read along the cycle and actions sent in it
+  '''
+  def __init__(self, path, instance = ''):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.path     = path
+    self.instance = instance
+    self.file     = None
+    self.cycle    = 0
+    self.started  = None
+    self.calls    = []
+    self.actions  = []
+    self.trackers = None
+
+  def open(self):
+    # runner processes write their own stream
+    stream = STREAMS.get(self.path)
+    if stream is None or stream['pid'] != os.getpid():
+      stream = {'file':  gzip.open(self.path, 'at', encoding='utf-8'),
+                'pid':   os.getpid(),
+                'users': set()}
+      STREAMS[self.path] = stream
+      self.logger.info("Recording cycles into %s"%self.path)
+    stream['users'].add(id(self))
+    self.file = stream['file']
+    return self.file
+
+  def read(self, method, args, result):
+    if self.started is None:
+      self.started = time.time()
+    self.calls.append([method, list(args), result])
+
+  def action(self, method, args):
+    self.actions.append([method, list(args)])
+
+  def end_cycle(self, trackers = None):
+    '''
+      Writes calls recorded since last cycle, if any, tracker list
+      is only written when it changed
+    '''
+    try:
+      if not self.calls and not self.actions:
+        return
+      self.cycle += 1
+      record = {
+        'cycle':    self.cycle,
+        'ts':       self.started or time.time(),
+        'instance': self.instance,
+        'calls':    self.calls,
+        'actions':  self.actions
+      }
+      if trackers is not None and trackers != self.trackers:
+        record['trackers'] = trackers
+        self.trackers = trackers
+
+      output = self.open()
+      output.write(json.dumps(record, separators=(',', ':')) + "\n")
+      # a killed monitor still leaves a readable file
+      output.flush()
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      self.started = None
+      self.calls   = []
+      self.actions = []
+
+  def close(self):
+    self.end_cycle()
+    if self.file is None:
+      return
+    # stream is closed by the last recorder writing into it
+    stream = STREAMS.get(self.path)
+    if stream is not None and stream['file'] is self.file:
+      stream['users'].discard(id(self))
+      if len(stream['users']) < 1:
+        stream['file'].close()
+        del STREAMS[self.path]
+    self.file = None
+
+class RecordingClient:
+  '''
+    Wraps a qBittorrent client, reads and actions are handed to a
+    recorder, coroutine methods are recorded once awaited
+  '''
+  def __init__(self, client, recorder):
+    self.__dict__['client']   = client
+    self.__dict__['recorder'] = recorder
+
+  def record(self, name, args, result):
+    if name in READ_CALLS:
+      self.recorder.read(name, args, result)
+    elif name in ACTION_CALLS:
+      self.recorder.action(name, args)
+
+  def __getattr__(self, name):
+    attribute = getattr(self.client, name)
+    if not callable(attribute) or \
+       (name not in READ_CALLS and name not in ACTION_CALLS):
+      return attribute
+
+    if asyncio.iscoroutinefunction(attribute):
+      async def recorded_coroutine(*args, **kwargs):
+        result = await attribute(*args, **kwargs)
+        self.record(name, args, result)
+        return result
+      return recorded_coroutine
+
+    def recorded(*args, **kwargs):
+      result = attribute(*args, **kwargs)
+      self.record(name, args, result)
+      return result
+    return recorded
+
+  def __setattr__(self, name, value):
+    setattr(self.client, name, value)
+
+def load_cycles(path, instance = None):
+  '''
+    Cycles of one instance, the first one recorded by default, as
+    a fleet records all its hosts into the same file
+  '''
+  with gzip.open(path, 'rt', encoding='utf-8') as records:
+    for line in records:
+      line = line.strip()
+      if not line:
+        continue
+      cycle = json.loads(line)
+      if instance is None:
+        instance = cycle.get('instance')
+      if cycle.get('instance') == instance:
+        yield cycle
+
+def action_set(actions):
+  '''
+    Actions as (method, infohash) items, so batching does not
+    tell two runs apart
+  '''
+  items = set()
+  for method, args in actions:
+    if method == 'add_trackers':
+      urls = args[1] if isinstance(args[1], str) else "\n".join(args[1])
+      items.add((method, args[0], urls))
+      continue
+    hashes = args[0] if isinstance(args[0], list) else [args[0]]
+    for infohash in hashes:
+      items.add((method, infohash))
+  return items
+
+class ReplayClient:
+  '''
+    Stands in for qbittorrent.Client with recorded cycles. Each
+    torrents() or sync_main_data() call moves to next cycle, at full
+    speed or paced as recorded. Actions sent are kept to be compared
+    against recorded ones.
+  '''
+  def __init__(self, path, realtime = False, instance = None):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.path     = path
+    self.realtime = realtime
+    self.verify   = True
+    self.url      = 'replay://%s/'%path
+    self.timeout  = None
+    self._is_authenticated = True
+    self.cycles   = load_cycles(path, instance)
+    self.cycle    = None
+    self.upcoming = None
+    self.reads    = {}
+    self.trackers = {}
+    self.issued   = []
+    self.replayed = 0
+    self.finished = False
+    self.offset   = 0
+    self.first_ts = None
+    self.start    = None
+
+  @property
+  def api_version(self):
+    return 'replay'
+
+  @property
+  def qbittorrent_version(self):
+    return os.path.basename(self.path)
+
+  def login(self, username = None, password = None):
+    self._is_authenticated = True
+
+  def peek(self):
+    '''
+      Returns cycle to be replayed next, None at the end
+    '''
+    if self.upcoming is None and not self.finished:
+      try:
+        self.upcoming = next(self.cycles)
+      except StopIteration:
+        self.finished = True
+    return self.upcoming
+
+  def next_cycle(self):
+    if self.peek() is None:
+      raise ReplayFinished
+    self.cycle    = self.upcoming
+    self.upcoming = None
+
+    ts = self.cycle['ts']
+    if self.first_ts is None:
+      self.first_ts = ts
+      self.start    = time.time()
+    if self.realtime:
+      delay = (ts - self.first_ts) - (time.time() - self.start)
+      if delay > 0:
+        time.sleep(delay)
+
+    # activity times keep their age relative to the recorded cycle
+    self.offset = time.time() - ts
+    self.issued = []
+    self.reads  = {}
+    for method, args, result in self.cycle['calls']:
+      if method == 'get_torrent_trackers':
+        self.trackers[args[0]] = result
+      else:
+        self.reads.setdefault(method, []).append(result)
+    self.replayed += 1
+
+  def shift(self, torrent):
+    if 'last_activity' in torrent:
+      torrent['last_activity'] += self.offset
+    return torrent
+
+  def read(self, method):
+    self.next_cycle()
+    results = self.reads.get(method)
+    if not results:
+      raise ReplayFinished
+    return results.pop(0)
+
+  def torrents(self, **filters):
+    return [self.shift(torrent) for torrent in self.read('torrents')]
+
+  def sync_main_data(self, rid = 0):
+    data = self.read('sync_main_data')
+    for torrent in data.get('torrents', {}).values():
+      self.shift(torrent)
+    return data
+
+  def get_torrent_trackers(self, infohash):
+    return self.trackers.get(infohash, [])
+
+  def pause_multiple(self, infohash_list):
+    self.issued.append(['pause_multiple', [infohash_list]])
+
+  def resume_multiple(self, infohash_list):
+    self.issued.append(['resume_multiple', [infohash_list]])
+
+  def recheck(self, infohash_list):
+    self.issued.append(['recheck', [infohash_list]])
+
+  def add_trackers(self, infohash, trackers):
+    self.issued.append(['add_trackers', [infohash, trackers]])
+
+  def differences(self):
+    '''
+      Actions of current cycle missing or added against recording
+    '''
+    if self.cycle is None:
+      return set(), set()
+    recorded = action_set(self.cycle['actions'])
+    replayed = action_set(self.issued)
+    return recorded - replayed, replayed - recorded
+
+def replay(options):
+  '''
+    Runs monitor cycles over a recording, reports cycle cost and
+    actions that differ from recorded ones
+  '''
+  logger = utilities.GetLogger('Replay')
+  import qbitorrent
+
+  path    = options.pop('file')
+  monitor = qbitorrent.QBitorrentMonitor(**options)
+  api     = ReplayClient(path, options.get('realtime'), options.pop('instance', None))
+  monitor.client.set_api(api)
+
+  # tracker list only comes from the recording, an empty one until
+  # it has any, nothing is downloaded nor probed
+  monitor.trackers.update_trackers = float('inf')
+  monitor.trackers.last_update     = time.time()
+  monitor.trackers.health          = None
+  elapsed = []
+  mismatches = 0
+  while api.peek() is not None:
+    # tracker list is never downloaded, recorded one is used
+    cycle = api.peek()
+    if cycle.get('trackers') is not None:
+      monitor.trackers.set_trackers(monitor.trackers.parse(cycle['trackers']))
+      monitor.trackers.last_update = time.time()
+
+    start = time.perf_counter()
+    monitor.update()
+    elapsed.append(time.perf_counter() - start)
+
+    missing, added = api.differences()
+    if missing or added:
+      mismatches += 1
+      logger.warning("Cycle %d: %d recorded actions missing, %d new"%
+                     (api.cycle['cycle'], len(missing), len(added)))
+      for item in sorted(missing):
+        logger.debug("  - %s"%str(item))
+      for item in sorted(added):
+        logger.debug("  + %s"%str(item))
+
+  if len(elapsed) < 1:
+    logger.warning("Nothing replayed from %s"%path)
+    return False
+
+  elapsed.sort()
+  percentile = lambda p: elapsed[min(len(elapsed) - 1, int(p * len(elapsed)))]
+  logger.info("Replayed %d cycles: mean %.3fs, p50 %.3fs, p99 %.3fs, max %.3fs"%
+              (len(elapsed), sum(elapsed) / len(elapsed), percentile(0.5),
+               percentile(0.99), elapsed[-1]))
+  logger.info("Cycles with different actions: %d"%mismatches)
+  return not (options.get('check') and mismatches > 0)
+
+if __name__ == '__main__':
+  logFormatter="'%(asctime)s|%(name)-15s|%(levelname)7s|%(message)s'"
+  logging.basicConfig(format=logFormatter, level=logging.INFO)
+  logger = utilities.GetLogger('Replay')
+
+  usage = "usage: %prog file [options]"
+  parser = OptionParser(usage=usage)
+  parser.add_option('--realtime',
+                action='store_true',
+                default=False,
+                help='Replay cycles paced as they were recorded')
+  parser.add_option('--check',
+                action='store_true',
+                default=False,
+                help='Fail if actions differ from recorded ones')
+  parser.add_option('--instance',
+                type="string",
+                action='store',
+                default=None,
+                help='host:port to replay from a fleet recording, first one by default')
+  parser.add_option('--sync_mode',
+                type="int",
+                action='store',
+                default=None,
+                help='Recording was taken in sync mode')
+  parser.add_option('--pause_expired',
+                type="int",
+                action='store',
+                default=None,
+                help='Pause expired torrents')
+  parser.add_option('--timeout_days',
+                type="int",
+                action='store',
+                default=None,
+                help='Days to consider a torrent expired')
+  parser.add_option('--max_ratio',
+                type="float",
+                action='store',
+                default=None,
+                help='Pause finished torrents over this ratio')
+  parser.add_option('--max_seeding_days',
+                type="int",
+                action='store',
+                default=None,
+                help='Pause finished torrents seeding longer')
+  parser.add_option('--debug',
+                action='store_true',
+                default=False,
+                help='Show every differing action')
+  (options, args) = parser.parse_args()
+  if len(args) != 1:
+    parser.error("recording file is required")
+
+  if options.debug:
+    logging.getLogger().setLevel(logging.DEBUG)
+  else:
+    # cycle logs would cost more than cycles themselves
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+  # monitor classes expect only given options
+  option_dict = dict([(key, value) for key, value in vars(options).items()
+                      if value is not None])
+  option_dict.update({'file': args[0], 'host': 'replay', 'port': 0})
+  sys.exit(0 if replay(option_dict) else 1)
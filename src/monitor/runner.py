@@ -6,13 +6,95 @@ SLEEP_TIME = 5
 
 import multiprocessing
 import utilities
+import select
+import socket
+import signal as signals
 import time
 import sys
+import os
 
-from pprint import pprint
 from signal import signal
-from signal import SIGTERM, SIGINT
-  
+from signal import SIGTERM, SIGINT, SIGUSR1
+
+class Scheduler:
+  '''
+    Picks how long to wait before next cycle. Failures back off
+    exponentially from sleep_time. In adaptive mode cycles come
+    sooner while torrents are downloading or about to complete,
+    and back off exponentially from time_out while all is idle.
+  '''
+  def __init__(self, **kwargs):
+    self.logger       = utilities.GetLogger("Scheduler")
+    self.time_out     = None
+    self.sleep_time   = SLEEP_TIME
+    self.adaptive     = False
+    self.min_time_out = None
+    self.max_time_out = None
+    self.idle_cycles  = 0
+    self.failures     = 0
+    try:
+      for key in kwargs.keys():
+        if key == "time_out":
+          self.time_out = kwargs[key]
+        elif key == "sleep_time" and kwargs[key] is not None:
+          self.sleep_time = kwargs[key]
+        elif key == "adaptive":
+          self.adaptive = bool(kwargs[key])
+        elif key == "min_time_out":
+          self.min_time_out = kwargs[key]
+        elif key == "max_time_out":
+          self.max_time_out = kwargs[key]
+
+      base = self.time_out or 0
+      if self.min_time_out is None:
+        self.min_time_out = base / 4.0
+      if self.max_time_out is None:
+        self.max_time_out = max(base * 8, TIMEOUT)
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def next_delay(self, ok, hint = None):
+    '''
+      Returns seconds to wait, hint may tell how many torrents are
+      'active' and 'near_completion', or 'retry_after' seconds
+    '''
+    hint = hint or {}
+    if not ok:
+      self.failures += 1
+      delay = self.sleep_time
+      if self.adaptive:
+        delay = min(self.sleep_time * 2**(self.failures - 1), TIMEOUT)
+      return max(delay, hint.get('retry_after', 0))
+
+    self.failures = 0
+    base = self.time_out or 0
+    if not self.adaptive:
+      return base
+
+    if hint.get('near_completion', 0) > 0:
+      self.idle_cycles = 0
+      delay = self.min_time_out
+    elif hint.get('active', 0) > 0:
+      self.idle_cycles = 0
+      delay = max(self.min_time_out, base / 2.0)
+    else:
+      delay = min(base * 2**self.idle_cycles, self.max_time_out)
+      self.idle_cycles += 1
+
+    self.logger.debug("  Next cycle in %.1fs"%delay)
+    return delay
+
+def wakeup_socket(path):
+  '''
+    Binds a local datagram socket, any message on it wakes the runner
+  '''
+  if os.path.exists(path):
+    os.unlink(path)
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+  sock.bind(path)
+  sock.setblocking(False)
+  return sock
+
 class Runner(multiprocessing.Process):
   def __init__(self, **kwargs):
     try:
@@ -26,6 +108,11 @@ class Runner(multiprocessing.Process):
       self.time_out     = None
       self.sleep_time   = SLEEP_TIME
       self.stop_running = False
+      self.wake_now     = False
+      self.hint_func    = None
+      self.wakeup_path  = None
+      self.wakeup_fds   = []
+      self.scheduler    = Scheduler(**kwargs)
 
       multiprocessing.Process.__init__(self)
       self.logger.debug("  Started runner process")
@@ -33,6 +120,7 @@ class Runner(multiprocessing.Process):
       # handle sigterm
       signal(SIGTERM,self.signal_handler)
       signal(SIGINT, self.signal_handler)
+      signal(SIGUSR1, self.wakeup_handler)
 
       for key in kwargs.keys():
         # print("--- key: %s"%key)
@@ -44,22 +132,59 @@ class Runner(multiprocessing.Process):
         elif key == "sleep_time":
           self.sleep_time = kwargs[key]
           self.logger.debug("  Set sleep time to %ds"%self.sleep_time)
+        elif key == "hint_func":
+          self.hint_func = kwargs[key]
+        elif key == "wakeup_socket":
+          self.wakeup_path = kwargs[key]
 
       self.start()
       self.logger.debug("  Created runner object")
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
-  def timeout(self, wakeup):
+  def timeout(self, deadline):
     try:
-      while time.time() - self.start_time < self.time_out and \
-            not self.stop_running:
-        time.sleep(self.sleep_time)
+      # signals and wake-up messages interrupt the wait
+      while not self.stop_running and not self.wake_now:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        readable = select.select(self.wakeup_fds, [], [], remaining)[0]
+        for sock in readable:
+          try:
+            sock.recv(4096)
+            if sock.fileno() != self.wakeup_fds[0].fileno():
+              self.wake_now = True
+          except (BlockingIOError, InterruptedError):
+            pass
+      self.wake_now = False
       self.logger.debug("  Executed runner's time out")
     
     except Exception as inst:
       utilities.ParseException(inst, logger=self.logger)
 
+  def open_wakeup(self):
+    '''
+      Signals are written into a socket pair so waiting can be
+      interrupted, called from the running process
+    '''
+    try:
+      reader, writer = socket.socketpair()
+      reader.setblocking(False)
+      writer.setblocking(False)
+      signals.set_wakeup_fd(writer.fileno())
+      self.wakeup_fds = [reader]
+      self.wakeup_writer = writer
+      if self.wakeup_path:
+        self.wakeup_fds.append(wakeup_socket(self.wakeup_path))
+        self.logger.debug("  Listening wake-up messages in %s"%self.wakeup_path)
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def wakeup_handler(self, signum, frame):
+    self.logger.info("  Waking up runner")
+    self.wake_now = True
+
   def signal_handler(self, signum, frame):
     # self.logger.debug("Signal Number:", signum, " Frame: ", frame) 
     self.logger.info("  Handling runner signal")
@@ -74,20 +199,23 @@ class Runner(multiprocessing.Process):
     '''
     try:
       self.logger.debug("  Running process")
+      self.open_wakeup()
       while not self.stop_running:
         self.logger.debug("  Looping process: [stop_running=%s]"%str(self.stop_running))
        
         # configured method from app
         self.start_time = time.time()
         ok = self.app_func()
+        hint = self.hint_func() if self.hint_func else None
+        delay = self.scheduler.next_delay(ok, hint)
 
         if not ok:
-          self.logger.debug("  App function failed to execute, sleeping %d"%self.sleep_time)
-          time.sleep(self.sleep_time)
+          self.logger.debug("  App function failed to execute, sleeping %d"%delay)
+          self.timeout(time.time() + delay)
         else:
           # sleep process for some time
           # self.logger.debug("  Timing out app function...")
-          self.timeout(self.wakeup)
+          self.timeout(self.start_time + delay)
 
       self.logger.info("Runner has been ended")
     except Exception as inst:
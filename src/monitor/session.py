@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import time
+import random
+import asyncio
+import utilities
+
+CLOSED    = 'closed'
+OPEN      = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitOpen(Exception):
+  def __init__(self, retry_after):
+    Exception.__init__(self, "Circuit open, retry in %.0fs"%retry_after)
+    self.retry_after = retry_after
+
+def http_status(inst):
+  '''
+    Status code of a requests or aiohttp error, None if the
+    host could not be reached
+  '''
+  status = getattr(inst, 'status', None)
+  response = getattr(inst, 'response', None)
+  if status is None and response is not None:
+    status = getattr(response, 'status_code', None)
+  return status
+
+def is_auth_error(inst):
+  # client library is imported once it is connected
+  from qbittorrent.client import LoginRequired
+  return isinstance(inst, LoginRequired) or http_status(inst) == 403
+
+def is_host_error(inst):
+  '''
+    Network errors, time outs and server errors tell the host is
+    down, other HTTP errors are answers to a bad request
+  '''
+  status = http_status(inst)
+  return status is None or status >= 500
+
+class Backoff:
+  '''
+    Exponential delays with jitter, half of each delay is random so
+    several monitors do not retry all at once
+  '''
+  def __init__(self, base = 5, cap = 300):
+    self.base     = base
+    self.cap      = cap
+    self.attempts = 0
+
+  def next(self):
+    delay = min(self.cap, self.base * 2**self.attempts)
+    self.attempts += 1
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+  def reset(self):
+    self.attempts = 0
+
+class CircuitBreaker:
+  '''
+    Opens after consecutive host failures and refuses calls until
+    a backoff delay is over, then lets a cycle through half-open
+    to probe the host again
+  '''
+  def __init__(self, **kwargs):
+    class_name  = self.__class__.__name__
+    self.logger = utilities.GetLogger(class_name)
+    self.state     = CLOSED
+    self.failures  = 0
+    self.threshold = 3
+    self.opened_until = 0
+    base = 5
+    cap  = 300
+    try:
+      for key in kwargs.keys():
+        if key == "breaker_failures" and kwargs[key]:
+          self.threshold = kwargs[key]
+        elif key == "sleep_time" and kwargs[key]:
+          base = kwargs[key]
+        elif key == "backoff_max" and kwargs[key]:
+          cap = kwargs[key]
+      self.backoff = Backoff(base, cap)
+      self.instance = "%s:%s"%(kwargs.get('host'), kwargs.get('port'))
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def allow(self):
+    if self.state == OPEN and time.time() >= self.opened_until:
+      self.state = HALF_OPEN
+      self.logger.info("  Circuit of %s half-open, probing host"%self.instance)
+    return self.state != OPEN
+
+  def retry_after(self):
+    if self.state != OPEN:
+      return 0
+    return max(0, self.opened_until - time.time())
+
+  def success(self):
+    if self.state != CLOSED:
+      self.logger.info("  Circuit of %s closed"%self.instance)
+    self.state    = CLOSED
+    self.failures = 0
+    self.backoff.reset()
+
+  def failure(self):
+    self.failures += 1
+    if self.state == HALF_OPEN or \
+       (self.state == CLOSED and self.failures >= self.threshold):
+      delay = self.backoff.next()
+      self.state = OPEN
+      self.opened_until = time.time() + delay
+      self.logger.warning("  Circuit of %s open after %d failures, retry in %.0fs"%
+                          (self.instance, self.failures, delay))
+
+class SessionClient:
+  '''
+    Wraps a qBittorrent client so calls go through the circuit
+    breaker, an expired session is logged in again and the call
+    is sent once more
+  '''
+  def __init__(self, client, breaker, login):
+    self.__dict__['client']  = client
+    self.__dict__['breaker'] = breaker
+    self.__dict__['login']   = login
+
+  def guard(self):
+    if not self.breaker.allow():
+      raise CircuitOpen(self.breaker.retry_after())
+
+  def failed(self, inst):
+    if is_host_error(inst):
+      self.breaker.failure()
+    else:
+      self.breaker.success()
+
+  def __getattr__(self, name):
+    attribute = getattr(self.client, name)
+    if not callable(attribute):
+      return attribute
+
+    if asyncio.iscoroutinefunction(attribute):
+      async def managed_coroutine(*args, **kwargs):
+        self.guard()
+        try:
+          try:
+            result = await attribute(*args, **kwargs)
+          except Exception as inst:
+            if not is_auth_error(inst) or not await self.login():
+              raise
+            result = await attribute(*args, **kwargs)
+        except Exception as inst:
+          self.failed(inst)
+          raise
+        self.breaker.success()
+        return result
+      return managed_coroutine
+
+    def managed(*args, **kwargs):
+      self.guard()
+      try:
+        try:
+          result = attribute(*args, **kwargs)
+        except Exception as inst:
+          if not is_auth_error(inst) or not self.login():
+            raise
+          result = attribute(*args, **kwargs)
+      except Exception as inst:
+        self.failed(inst)
+        raise
+      self.breaker.success()
+      return result
+    return managed
+
+  def __setattr__(self, name, value):
+    setattr(self.client, name, value)
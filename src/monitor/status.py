@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import sys
+import time
+import json
+import logging
+import utilities
+
+from datetime import timedelta
+
+ROW_FORMAT = "%18s|%s|%7s|%9s/s|%9s|%9s| %3d/%3d | %s"
+
+class LazyData:
+  '''
+    Human readable size only formatted when a log line is emitted
+  '''
+  __slots__ = ('num',)
+
+  def __init__(self, num):
+    self.num = num
+
+  def __str__(self):
+    return utilities.human_readable_data(self.num)
+
+class StatusRenderer:
+  '''
+    Logs torrent rows whose state, progress bucket or speed bucket
+    changed since last cycle, whole table is logged every
+    full_every cycles. Changed rows can also go as JSON lines.
+    Rows show the ETA given by eta(infohash) when it is set.
+  '''
+  def __init__(self, **kwargs):
+    class_name  = self.__class__.__name__
+    self.logger = utilities.GetLogger(class_name)
+    self.full_every    = 10
+    self.progress_step = 5
+    self.json_path     = None
+    self.json_file     = None
+    self.cycle    = 0
+    self.previous = {}
+    self.eta      = None
+    try:
+      for key in kwargs.keys():
+        if key == "full_table_every" and kwargs[key]:
+          self.full_every = kwargs[key]
+        elif key == "progress_step" and kwargs[key]:
+          self.progress_step = kwargs[key]
+        elif key == "status_json":
+          self.json_path = kwargs[key]
+
+      self.instance = "%s:%s"%(kwargs.get('host'), kwargs.get('port'))
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def key(self, torrent):
+    '''
+      Row changes when state, progress bucket or order of
+      magnitude of download speed changes
+    '''
+    return (torrent["state"],
+            int(torrent["progress"] * 100) // self.progress_step,
+            int(torrent["dlspeed"]).bit_length())
+
+  def torrent_eta(self, torrent):
+    ''' Seconds to completion, None if unknown '''
+    if self.eta is None or torrent["progress"] >= 1:
+      return None
+    return self.eta(torrent["hash"])
+
+  def row(self, torrent):
+    dlspeed = torrent["dlspeed"]
+    eta = self.torrent_eta(torrent)
+    self.logger.info(ROW_FORMAT,
+                     torrent["state"],
+                     "   " if dlspeed == 0 else " * ",
+                     "%3.2f%%"%(torrent["progress"]*100),
+                     LazyData(dlspeed),
+                     LazyData(torrent["size"] - torrent["downloaded"]),
+                     "-" if eta is None else str(timedelta(seconds=int(eta))),
+                     torrent["num_seeds"], torrent["num_leechs"],
+                     torrent["name"])
+
+  def output(self):
+    if self.json_file is None:
+      if self.json_path == '-':
+        self.json_file = sys.stdout
+      else:
+        self.json_file = open(self.json_path, 'a', buffering=1)
+    return self.json_file
+
+  def write_json(self, torrents, now):
+    output = self.output()
+    for torrent in torrents:
+      eta = self.torrent_eta(torrent)
+      output.write(json.dumps({
+        'ts':       round(now, 3),
+        'instance': self.instance,
+        'hash':     torrent["hash"],
+        'name':     torrent["name"],
+        'state':    torrent["state"],
+        'progress': round(torrent["progress"], 4),
+        'dlspeed':  torrent["dlspeed"],
+        'left':     torrent["size"] - torrent["downloaded"],
+        'eta':      None if eta is None else int(eta),
+        'seeds':    torrent["num_seeds"],
+        'leechs':   torrent["num_leechs"]
+      }, separators=(',', ':')) + "\n")
+    output.flush()
+
+  def render(self, torrents, all_torrents):
+    '''
+      Compares given torrents against last rendered rows, all
+      torrents is the whole table of current cycle
+    '''
+    changed = 0
+    try:
+      self.cycle += 1
+      full = (self.cycle - 1) % self.full_every == 0
+
+      changes = []
+      for torrent in torrents:
+        key = self.key(torrent)
+        if self.previous.get(torrent["hash"]) != key:
+          self.previous[torrent["hash"]] = key
+          changes.append(torrent)
+      changed = len(changes)
+
+      # forget rows of removed torrents
+      if full or len(self.previous) > len(all_torrents):
+        current = set([torrent["hash"] for torrent in all_torrents])
+        for infohash in [infohash for infohash in self.previous
+                         if infohash not in current]:
+          del self.previous[infohash]
+
+      if self.logger.isEnabledFor(logging.INFO):
+        rows = all_torrents if full else changes
+        for torrent in rows:
+          self.row(torrent)
+        if not full and len(all_torrents) > changed:
+          self.logger.info("  %d of %d torrents changed", changed, len(all_torrents))
+
+      if self.json_path and changes:
+        self.write_json(changes, time.time())
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return changed
+
+  def close(self):
+    if self.json_file is not None and self.json_file is not sys.stdout:
+      self.json_file.close()
+    self.json_file = None
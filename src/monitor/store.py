@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import os
+import sqlite3
+import hashlib
+import utilities
+
+class StateStore:
+  '''
+    Keeps TorrentState and tracker list in a SQLite database in WAL
+    mode, so a restarted monitor resumes where it left off. Only
+    records changed along a cycle are written.
+  '''
+  def __init__(self, **kwargs):
+    class_name      = self.__class__.__name__
+    self.logger     = utilities.GetLogger(class_name)
+    self.path       = None
+    self.instance   = ''
+    self.max_writes = 1000
+    self.db         = None
+    self.pid        = None
+    self.trackers_hash = None
+    try:
+      for key in kwargs.keys():
+        if key == "state_db":
+          self.path = kwargs[key]
+        elif key == "state_max_writes" and kwargs[key]:
+          self.max_writes = kwargs[key]
+
+      # a database can be shared by several hosts
+      self.instance = "%s:%s"%(kwargs.get('host'), kwargs.get('port'))
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def connect(self):
+    # connections are not carried over to forked runner processes
+    if self.db is not None and self.pid == os.getpid():
+      return self.db
+
+    self.db  = sqlite3.connect(self.path)
+    self.pid = os.getpid()
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript('''
+      CREATE TABLE IF NOT EXISTS torrents (
+        instance             TEXT,
+        infohash             TEXT,
+        name                 TEXT,
+        last_update_trackers REAL,
+        trackers_hash        TEXT,
+        trackers_set         TEXT,
+        managed              INTEGER DEFAULT 0,
+        PRIMARY KEY (instance, infohash));
+      CREATE TABLE IF NOT EXISTS tracker_sets (
+        set_hash TEXT PRIMARY KEY,
+        urls     TEXT);
+      CREATE TABLE IF NOT EXISTS meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT);
+    ''')
+
+    # databases written before slot optimizer
+    columns = [row[1] for row in self.db.execute("PRAGMA table_info(torrents)")]
+    if 'managed' not in columns:
+      self.db.execute("ALTER TABLE torrents ADD COLUMN managed INTEGER DEFAULT 0")
+    return self.db
+
+  def load(self, state, trackers):
+    try:
+      db = self.connect()
+
+      # tracker list is shared by all instances
+      meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+      if meta.get('trackers_data') and trackers.data is None:
+        trackers.set_trackers(trackers.parse(meta['trackers_data']))
+        trackers.etag          = meta.get('etag')
+        trackers.last_modified = meta.get('last_modified')
+        trackers.last_update   = float(meta.get('last_update', 0))
+      self.trackers_hash = meta.get('trackers_hash')
+
+      sets = {}
+      rows = db.execute("SELECT infohash, name, last_update_trackers, "
+                        "trackers_hash, trackers_set, managed FROM torrents "
+                        "WHERE instance = ?", (self.instance,))
+      for infohash, name, last_update, trackers_hash, set_hash, managed in rows:
+        record = state.set_status({'hash': infohash, 'name': name})
+        record.last_update_trackers = last_update
+        record.trackers_hash        = trackers_hash
+        record.managed              = bool(managed)
+        if set_hash is not None:
+          if set_hash not in sets:
+            urls = db.execute("SELECT urls FROM tracker_sets WHERE set_hash = ?",
+                              (set_hash,)).fetchone()
+            sets[set_hash] = urls[0].split("\n") if urls else None
+          if sets[set_hash] is not None:
+            state.set_trackers({'hash': infohash, 'name': name}, sets[set_hash])
+
+      # loading is not a change to be written back
+      state.dirty.clear()
+
+      # forget tracker sets no torrent points to anymore
+      with db:
+        db.execute("DELETE FROM tracker_sets WHERE set_hash NOT IN "
+                   "(SELECT trackers_set FROM torrents "
+                   "WHERE trackers_set IS NOT NULL)")
+      self.logger.info("Loaded %d torrents of %s from %s"%
+                       (len(state.status), self.instance, self.path))
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      # loading might happen before the runner forks
+      self.close()
+
+  def close(self):
+    if self.db is not None:
+      self.db.close()
+      self.db = None
+
+  def save(self, state, trackers):
+    '''
+      Writes records changed since last save, at most max_writes
+      per call and the rest on following ones
+    '''
+    written = 0
+    try:
+      db = self.connect()
+      with db:
+        if trackers.hash is not None and trackers.hash != self.trackers_hash:
+          meta = {
+            'trackers_data': "\n".join(trackers.candidates),
+            'trackers_hash': trackers.hash,
+            'etag':          trackers.etag,
+            'last_modified': trackers.last_modified
+          }
+          db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta.items())
+          self.trackers_hash = trackers.hash
+        db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                   ('last_update', str(trackers.last_update)))
+
+        for infohash in list(state.dirty)[:self.max_writes]:
+          state.dirty.discard(infohash)
+          record = state.get_status(infohash)
+          if record is None:
+            db.execute("DELETE FROM torrents WHERE instance = ? AND infohash = ?",
+                       (self.instance, infohash))
+          else:
+            set_hash = None
+            if record.trackers is not None:
+              urls = "\n".join(sorted(record.trackers))
+              set_hash = hashlib.sha1(urls.encode('utf-8')).hexdigest()
+              db.execute("INSERT OR IGNORE INTO tracker_sets VALUES (?, ?)",
+                         (set_hash, urls))
+            db.execute("INSERT OR REPLACE INTO torrents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (self.instance, infohash, record.name,
+                        record.last_update_trackers, record.trackers_hash, set_hash,
+                        int(record.managed)))
+          written += 1
+
+      if written > 0:
+        self.logger.debug("    Saved %d torrents, %d pending"%(written, len(state.dirty)))
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+    finally:
+      return written
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import time
+import socket
+import struct
+import asyncio
+import unittest
+
+from urllib.parse import urlparse
+from tracker_health import TrackerHealth, probe_udp, probe_http, UDP_PROTOCOL_ID, UDP_CONNECT
+from fake_trackers import FakeUdpTracker, FakeHttpTracker, UDP_ANNOUNCE
+
+def closed_port():
+  ''' A local port nothing listens on '''
+  sock = socket.socket()
+  sock.bind(('127.0.0.1', 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+class TrackerHealthTest(unittest.TestCase):
+  def setUp(self):
+    self.servers = []
+
+  def tearDown(self):
+    for server in self.servers:
+      server.stop()
+
+  def tracker(self, fake, scheme):
+    port = fake.serve()
+    self.servers.append(fake)
+    if scheme == 'udp':
+      return 'udp://127.0.0.1:%d/announce'%port
+    return 'http://127.0.0.1:%d/announce'%port
+
+  def probe(self, health, trackers):
+    start = time.time()
+    asyncio.run(health.probe(trackers))
+    return time.time() - start
+
+  def test_udp_connect(self):
+    tracker = self.tracker(FakeUdpTracker(), 'udp')
+    self.assertTrue(asyncio.run(probe_udp(urlparse(tracker))))
+
+  def test_udp_announce(self):
+    # stand-in answers announces with the connection id it handed out
+    port = self.tracker(FakeUdpTracker(), 'udp').split(':')[2].split('/')[0]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(2)
+    address = ('127.0.0.1', int(port))
+    try:
+      sock.sendto(struct.pack('>QII', UDP_PROTOCOL_ID, UDP_CONNECT, 7), address)
+      action, transaction, connection_id = struct.unpack('>IIQ', sock.recv(16))
+      self.assertEqual((action, transaction), (UDP_CONNECT, 7))
+
+      announce = struct.pack('>QII', connection_id, UDP_ANNOUNCE, 8) + bytes(82)
+      sock.sendto(announce, address)
+      action, transaction, interval, leechers, seeders = struct.unpack('>IIIII', sock.recv(20))
+      self.assertEqual((action, transaction, interval), (UDP_ANNOUNCE, 8, 1800))
+    finally:
+      sock.close()
+
+  def test_http_announce(self):
+    alive  = self.tracker(FakeHttpTracker(), 'http')
+    broken = self.tracker(FakeHttpTracker(status=500), 'http')
+    self.assertTrue(asyncio.run(probe_http(urlparse(alive))))
+    self.assertFalse(asyncio.run(probe_http(urlparse(broken))))
+    # announce arguments are checked by the stand-in
+    self.assertFalse(asyncio.run(probe_http(urlparse(alive.replace('/announce', '/scrape')))))
+
+  def test_latency_ranking(self):
+    slow = self.tracker(FakeHttpTracker(latency=0.3), 'http')
+    fast = self.tracker(FakeHttpTracker(), 'http')
+    udp  = self.tracker(FakeUdpTracker(latency=0.15), 'udp')
+    health = TrackerHealth(tracker_top=3, probe_timeout=2)
+    self.probe(health, [slow, udp, fast])
+    self.assertEqual(health.best([slow, udp, fast]), [fast, udp, slow])
+
+  def test_top_trackers(self):
+    slow = self.tracker(FakeHttpTracker(latency=0.3), 'http')
+    fast = self.tracker(FakeHttpTracker(), 'http')
+    health = TrackerHealth(tracker_top=1, probe_timeout=2)
+    # order of list is kept until trackers are probed
+    self.assertEqual(health.best([slow, fast]), [slow])
+    self.probe(health, [slow, fast])
+    self.assertEqual(health.best([slow, fast]), [fast])
+
+  def test_dead_trackers_dropped(self):
+    alive   = self.tracker(FakeHttpTracker(), 'http')
+    broken  = self.tracker(FakeHttpTracker(status=500), 'http')
+    refused = 'http://127.0.0.1:%d/announce'%closed_port()
+    unknown = 'wss://127.0.0.1:1/announce'
+    health = TrackerHealth(tracker_top=10, probe_timeout=2)
+    self.probe(health, [broken, refused, alive, unknown])
+    self.assertEqual(health.best([broken, refused, alive, unknown]), [alive])
+    self.assertFalse(health.healthy(broken))
+    self.assertFalse(health.healthy(refused))
+
+  def test_timeouts(self):
+    silent_udp  = self.tracker(FakeUdpTracker(silent=True), 'udp')
+    silent_http = self.tracker(FakeHttpTracker(silent=True), 'http')
+    alive       = self.tracker(FakeUdpTracker(), 'udp')
+    health = TrackerHealth(tracker_top=10, probe_timeout=0.5)
+    elapsed = self.probe(health, [silent_udp, silent_http, alive])
+
+    # probes run concurrently, a silent tracker costs one timeout
+    self.assertLess(elapsed, 1.5)
+    self.assertEqual(health.best([silent_udp, silent_http, alive]), [alive])
+    self.assertEqual(health.scores[silent_udp]['latency'], 0.5)
+    self.assertEqual(health.scores[silent_http]['success'], 0.0)
+
+  def test_recovery_is_weighted(self):
+    fake    = FakeHttpTracker(status=500)
+    tracker = self.tracker(fake, 'http')
+    health  = TrackerHealth(tracker_top=10, probe_timeout=2)
+    self.probe(health, [tracker])
+    self.assertFalse(health.healthy(tracker))
+
+    # one good answer is not enough to trust it again
+    fake.status = 200
+    self.probe(health, [tracker])
+    self.assertFalse(health.healthy(tracker))
+    for attempt in range(2):
+      self.probe(health, [tracker])
+    self.assertTrue(health.healthy(tracker))
+
+  def test_forgotten_trackers(self):
+    first  = self.tracker(FakeHttpTracker(), 'http')
+    second = self.tracker(FakeHttpTracker(), 'http')
+    health = TrackerHealth(tracker_top=10, probe_timeout=2)
+    self.probe(health, [first, second])
+    self.probe(health, [second])
+    self.assertEqual(list(health.scores), [second])
+
+if __name__ == '__main__':
+  unittest.main()
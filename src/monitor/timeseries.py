@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import time
+import utilities
+import importlib.util
+
+# loaded with first sample, as in policies
+numpy = None
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+FIELDS = ('dlspeed', 'progress', 'num_seeds', 'num_leechs')
+
+class Ring:
+  '''
+    Fixed number of points for a set of rows, all rows share
+    timestamps of the points
+  '''
+  def __init__(self, rows, capacity, fields):
+    self.capacity = capacity
+    self.times    = numpy.full(capacity, numpy.nan)
+    self.values   = numpy.full((rows, capacity, fields), numpy.nan, dtype=numpy.float32)
+    self.head     = 0
+    self.count    = 0
+
+  def append(self, ts, values):
+    self.times[self.head]     = ts
+    self.values[:, self.head] = values
+    self.head  = (self.head + 1) % self.capacity
+    self.count = min(self.count + 1, self.capacity)
+
+  def order(self):
+    # point positions, oldest first
+    return (numpy.arange(self.count) + self.head - self.count) % self.capacity
+
+  def oldest(self):
+    if self.count < 1:
+      return None
+    return self.times[(self.head - self.count) % self.capacity]
+
+  def clear(self, row):
+    self.values[row] = numpy.nan
+
+  def nbytes(self):
+    return self.times.nbytes + self.values.nbytes
+
+class Tiers:
+  '''
+    Rings of growing resolution, every factor points of a ring
+    are averaged into one point of the next one
+  '''
+  def __init__(self, rows, fields, capacity, levels, factor):
+    self.factor  = factor
+    self.rings   = [Ring(rows, capacity, fields) for level in range(levels)]
+    self.pending = [0] * levels
+
+  def append(self, ts, values):
+    for level, ring in enumerate(self.rings):
+      ring.append(ts, values)
+      self.pending[level] += 1
+      if self.pending[level] < self.factor or level + 1 == len(self.rings):
+        return
+      self.pending[level] = 0
+
+      # average goes on to next ring, missing points do not count
+      points = ring.values[:, ring.order()[-self.factor:]]
+      known  = ~numpy.isnan(points)
+      with numpy.errstate(invalid='ignore', divide='ignore'):
+        values = numpy.where(known, points, 0).sum(axis=1) / known.sum(axis=1)
+
+  def clear(self, row):
+    for ring in self.rings:
+      ring.clear(row)
+
+  def window(self, since):
+    '''
+      Finest ring covering given time, or the one going furthest
+      back, with positions of its points since then
+    '''
+    ring = self.rings[0]
+    for candidate in self.rings:
+      oldest = candidate.oldest()
+      if oldest is None:
+        break
+      if ring.oldest() is None or oldest < ring.oldest():
+        ring = candidate
+      if oldest <= since:
+        ring = candidate
+        break
+    positions = ring.order()
+    return ring, positions[ring.times[positions] >= since]
+
+  def nbytes(self):
+    return sum([ring.nbytes() for ring in self.rings])
+
+class TimeSeries:
+  '''
+    In-process history of incomplete torrents and of fleet download
+    speed. Each torrent owns a row of fixed size rings, older points
+    are downsampled into coarser rings, so memory only depends on
+    number of rows and points.
+  '''
+  def __init__(self, **kwargs):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.rows     = 2000
+    self.points   = 120
+    self.levels   = 3
+    self.factor   = 10
+    self.index    = {}
+    self.free     = []
+    self.dropped  = 0
+    self.series   = None
+    self.fleet    = None
+    try:
+      for key in kwargs.keys():
+        if key == "history_torrents" and kwargs[key] is not None:
+          self.rows = kwargs[key]
+        elif key == "history_points" and kwargs[key]:
+          self.points = kwargs[key]
+
+      self.free   = list(range(self.rows - 1, -1, -1))
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def allocate(self):
+    global numpy
+    import numpy
+    self.series = Tiers(self.rows, len(FIELDS), self.points, self.levels, self.factor)
+    self.fleet  = Tiers(1, 1, self.points, self.levels, self.factor)
+
+  def row(self, infohash):
+    row = self.index.get(infohash)
+    if row is None and self.free:
+      row = self.free.pop()
+      self.series.clear(row)
+      self.index[infohash] = row
+    return row
+
+  def release(self, infohash):
+    row = self.index.pop(infohash, None)
+    if row is not None:
+      self.free.append(row)
+
+  def add(self, torrents, sum_dlspeed, ts = None):
+    '''
+      Samples a cycle snapshot, finished and removed torrents give
+      their rows back
+    '''
+    try:
+      if self.series is None:
+        self.allocate()
+      ts = time.time() if ts is None else ts
+      values = numpy.full((self.rows, len(FIELDS)), numpy.nan, dtype=numpy.float32)
+      seen = set()
+      dropped = 0
+      for torrent in torrents:
+        infohash = torrent["hash"]
+        if torrent["progress"] >= 1:
+          self.release(infohash)
+          continue
+        row = self.row(infohash)
+        if row is None:
+          dropped += 1
+          continue
+        seen.add(infohash)
+        values[row] = [torrent.get(field, numpy.nan) for field in FIELDS]
+
+      for infohash in [infohash for infohash in self.index if infohash not in seen]:
+        self.release(infohash)
+
+      if dropped != self.dropped:
+        self.dropped = dropped
+        if dropped > 0:
+          self.logger.debug("    History is full, %d torrents not kept"%dropped)
+
+      self.series.append(ts, values)
+      self.fleet.append(ts, [[sum_dlspeed]])
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def last(self, infohash, minutes, now = None):
+    '''
+      Points of a torrent in last minutes as field arrays with
+      their timestamps, None if torrent is not kept
+    '''
+    row = self.index.get(infohash)
+    if row is None:
+      return None
+    now = time.time() if now is None else now
+    ring, positions = self.series.window(now - minutes * 60)
+    points = {'time': ring.times[positions]}
+    for column, field in enumerate(FIELDS):
+      points[field] = ring.values[row, positions, column]
+    return points
+
+  def eta(self, infohash, minutes = 10, now = None):
+    '''
+      Seconds to completion from progress trend of last minutes,
+      None while it is unknown or not progressing
+    '''
+    points = self.last(infohash, minutes, now)
+    if points is None:
+      return None
+    known = ~numpy.isnan(points['progress'])
+    if known.sum() < 2:
+      return None
+    times    = points['time'][known]
+    progress = points['progress'][known].astype(numpy.float64)
+    rate = numpy.polyfit(times - times[0], progress, 1)[0]
+    if rate <= 0 or progress[-1] <= progress[0]:
+      return None
+    return (1.0 - progress[-1]) / rate
+
+  def throughput(self, minutes, percentiles = (50, 90, 99), now = None):
+    '''
+      Percentiles of fleet download speed in last minutes
+    '''
+    if self.fleet is None:
+      return None
+    now = time.time() if now is None else now
+    ring, positions = self.fleet.window(now - minutes * 60)
+    speeds = ring.values[0, positions, 0]
+    if len(speeds) < 1:
+      return None
+    return dict(zip(percentiles, numpy.percentile(speeds, percentiles).tolist()))
+
+  def memory_usage(self):
+    if self.series is None:
+      return {'torrents': 0, 'bytes': 0}
+    return {'torrents': len(self.index),
+            'bytes':    self.series.nbytes() + self.fleet.nbytes()}
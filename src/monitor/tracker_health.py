@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+import os
+import time
+import struct
+import random
+import asyncio
+import utilities
+
+from urllib.parse import urlparse, quote_from_bytes
+
+# BEP 15 connect request
+UDP_PROTOCOL_ID = 0x41727101980
+UDP_CONNECT     = 0
+
+class UdpProbe(asyncio.DatagramProtocol):
+  '''
+    Sends a UDP tracker connect request, answer is resolved into
+    given future
+  '''
+  def __init__(self, answer):
+    self.answer      = answer
+    self.transaction = random.getrandbits(32)
+
+  def connection_made(self, transport):
+    transport.sendto(struct.pack('>QII', UDP_PROTOCOL_ID, UDP_CONNECT, self.transaction))
+
+  def datagram_received(self, data, addr):
+    if self.answer.done() or len(data) < 16:
+      return
+    action, transaction, _ = struct.unpack('>IIQ', data[:16])
+    self.answer.set_result(action == UDP_CONNECT and transaction == self.transaction)
+
+  def error_received(self, exc):
+    if not self.answer.done():
+      self.answer.set_exception(exc)
+
+async def probe_udp(url):
+  loop   = asyncio.get_running_loop()
+  answer = loop.create_future()
+  transport, _ = await loop.create_datagram_endpoint(
+    lambda: UdpProbe(answer), remote_addr=(url.hostname, url.port or 80))
+  try:
+    return await answer
+  finally:
+    transport.close()
+
+async def probe_http(url):
+  '''
+    Announces an unknown torrent, any answer from the tracker
+    tells it is alive
+  '''
+  https = url.scheme == 'https'
+  port  = url.port or (443 if https else 80)
+  query = "info_hash=%s&peer_id=%s&port=6881&uploaded=0&downloaded=0&left=0&compact=1&numwant=0"% \
+          (quote_from_bytes(os.urandom(20)), quote_from_bytes(b'-SM0001-' + os.urandom(6).hex().encode()))
+  path  = (url.path or '/') + '?' + (url.query + '&' if url.query else '') + query
+
+  context = None
+  if https:
+    import ssl
+    context = ssl.create_default_context()
+  reader, writer = await asyncio.open_connection(url.hostname, port, ssl=context)
+  try:
+    writer.write(("GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n"%
+                  (path, url.netloc)).encode('latin-1'))
+    await writer.drain()
+    status = (await reader.readline()).split()
+    return len(status) > 1 and status[1].startswith(b'2')
+  finally:
+    writer.close()
+
+PROBES = {
+  'udp':   probe_udp,
+  'http':  probe_http,
+  'https': probe_http,
+}
+
+class TrackerHealth:
+  '''
+    Rolling score of trackers from concurrent probes, success rate
+    and latency are exponentially weighted. Only top healthy ones
+    are handed to torrents.
+  '''
+  def __init__(self, **kwargs):
+    class_name    = self.__class__.__name__
+    self.logger   = utilities.GetLogger(class_name)
+    self.top      = 0
+    self.timeout  = 5
+    self.parallel = 32
+    self.interval = 3600*6
+    self.alpha    = 0.3
+    self.min_success = 0.5
+    self.scores   = {}
+    self.last_probe = 0
+    try:
+      for key in kwargs.keys():
+        if key == "tracker_top" and kwargs[key]:
+          self.top = kwargs[key]
+        elif key == "probe_timeout" and kwargs[key]:
+          self.timeout = kwargs[key]
+        elif key == "probe_parallel" and kwargs[key]:
+          self.parallel = max(1, kwargs[key])
+        elif key == "probe_interval" and kwargs[key]:
+          self.interval = kwargs[key]
+
+    except Exception as inst:
+      utilities.ParseException(inst, logger=self.logger)
+
+  def due(self):
+    return time.time() - self.last_probe >= self.interval
+
+  def update(self, tracker, success, latency):
+    score = self.scores.get(tracker)
+    if score is None:
+      score = {'success': 1.0 if success else 0.0, 'latency': latency, 'probes': 0}
+      self.scores[tracker] = score
+    else:
+      score['success'] += self.alpha * ((1.0 if success else 0.0) - score['success'])
+      if success:
+        score['latency'] += self.alpha * (latency - score['latency'])
+    score['probes'] += 1
+
+  async def probe_one(self, tracker, semaphore):
+    url   = urlparse(tracker)
+    probe = PROBES.get(url.scheme)
+    if probe is None:
+      return
+    async with semaphore:
+      loop  = asyncio.get_running_loop()
+      start = loop.time()
+      try:
+        success = await asyncio.wait_for(probe(url), self.timeout)
+      except Exception:
+        success = False
+      latency = loop.time() - start
+    self.update(tracker, success, latency if success else self.timeout)
+
+  async def probe(self, trackers):
+    # trackers gone from the list are forgotten
+    for tracker in set(self.scores) - set(trackers):
+      del self.scores[tracker]
+
+    semaphore = asyncio.Semaphore(self.parallel)
+    start = time.time()
+    await asyncio.gather(*[self.probe_one(tracker, semaphore) for tracker in trackers])
+    self.last_probe = time.time()
+
+    healthy = len([tracker for tracker in trackers if self.healthy(tracker)])
+    self.logger.info("    Probed %d trackers in %.1fs, %d healthy"%
+                     (len(trackers), self.last_probe - start, healthy))
+
+  def healthy(self, tracker):
+    score = self.scores.get(tracker)
+    return score is not None and score['success'] >= self.min_success
+
+  def score(self, tracker):
+    score = self.scores[tracker]
+    return score['success'] / (1.0 + score['latency'])
+
+  def best(self, trackers):
+    '''
+      Top healthy trackers, list order is kept until they are probed
+    '''
+    if not self.scores:
+      return trackers[:self.top]
+    healthy = [tracker for tracker in trackers if self.healthy(tracker)]
+    healthy.sort(key=self.score, reverse=True)
+    return healthy[:self.top]